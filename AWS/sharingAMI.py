@@ -1,14 +1,28 @@
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from sys import argv
 
 import boto3
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
 
 TARGET_ACCOUNT_ID = '<ACCOUNT ID>'
 ROLE_ON_TARGET_ACCOUNT = 'arn:aws:iam::<ACCOUNT ID>:role/<ROLENAME>'
 SOURCE_REGION = 'us-east-1'
 TARGET_REGION = 'us-east-1'
 
+SESSION_NAME = 'share-admin-temp-session'
+# Concurrency limits of the config file and their defaults
+LIMITS = {'max_workers': 8, 'max_per_account': 2, 'max_per_region': 4}
 
-def role_arn_to_session(**args):
+_credentials_cache = {}
+_credentials_lock = threading.Lock()
+
+
+def role_arn_to_session(sts_client=None, **args):
     """
     Lets you assume a role and returns a session ready to use
     Usage :
@@ -16,106 +30,253 @@ def role_arn_to_session(**args):
             RoleArn='arn:aws:iam::012345678901:role/example-role',
             RoleSessionName='ExampleSessionName')
         client = session.client('sqs')
+
+    The assumed-role credentials are shared per RoleArn/RoleSessionName and
+    refreshed by botocore from STS whenever they get close to expiring, also in
+    the middle of a long copy and wait. A new Session is returned on every call
+    because boto3 sessions are not thread safe. Pass an sts_client created in
+    the main thread when calling it from worker threads: botocore refreshes the
+    credentials from whichever thread finds them about to expire.
     """
-    client = boto3.client('sts')
-    response = client.assume_role(**args)
-    return boto3.Session(
-        aws_access_key_id=response['Credentials']['AccessKeyId'],
-        aws_secret_access_key=response['Credentials']['SecretAccessKey'],
-        aws_session_token=response['Credentials']['SessionToken'])
-
-
-if len(argv) != 2:
-    print('usage: share-ami.py [ami]')
-    exit(1)
-
-source_ec2 = boto3.resource('ec2')
-source_ami = source_ec2.Image(argv[1])
-
-source_snapshot = source_ec2.Snapshot(source_ami.block_device_mappings[0]['Ebs']['SnapshotId'])
-
-# Ensure the snapshot is shared with target account
-source_sharing = source_snapshot.describe_attribute(Attribute='createVolumePermission')
-if source_sharing['CreateVolumePermissions'] \
-        and source_sharing['CreateVolumePermissions'][0]['UserId'] != TARGET_ACCOUNT_ID:
-    print("Snapshot already shared with account, creating a copy")
-else:
-    print("Sharing with target account")
+    key = (args.get('RoleArn'), args.get('RoleSessionName'))
+    with _credentials_lock:
+        credentials = _credentials_cache.get(key)
+        if credentials is None:
+            sts_client = sts_client or boto3.client('sts')
+            credentials = RefreshableCredentials.create_from_metadata(
+                metadata=_assume_role(sts_client, args),
+                refresh_using=partial(_assume_role, sts_client, args),
+                method='sts-assume-role')
+            _credentials_cache[key] = credentials
+    botocore_session = get_session()
+    botocore_session._credentials = credentials
+    return boto3.Session(botocore_session=botocore_session)
+
+
+def _assume_role(sts_client, args):
+    credentials = sts_client.assume_role(**args)['Credentials']
+    return {
+        'access_key': credentials['AccessKeyId'],
+        'secret_key': credentials['SecretAccessKey'],
+        'token': credentials['SessionToken'],
+        'expiry_time': credentials['Expiration'].isoformat(),
+    }
+
+
+def load_targets(config_file):
+    """
+    Reads the distribution matrix from a JSON config file.
+    Example :
+        {
+            "source_region": "us-east-1",
+            "max_workers": 8,
+            "max_per_account": 2,
+            "max_per_region": 4,
+            "targets": [
+                {
+                    "account_id": "012345678901",
+                    "role_arn": "arn:aws:iam::012345678901:role/example-role",
+                    "regions": ["us-east-1", "eu-west-1"]
+                }
+            ]
+        }
+    Returns the config and the flat list of (account_id, role_arn, region) targets.
+    Raises ValueError when a concurrency limit is not an integer >= 1.
+    """
+    with open(config_file) as fh:
+        config = json.load(fh)
+    check_limits(config)
+
+    targets = []
+    for target in config['targets']:
+        for region in target['regions']:
+            targets.append((target['account_id'], target['role_arn'], region))
+    return config, targets
+
+
+def check_limits(config):
+    for name, default in LIMITS.items():
+        value = config.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"{name} must be an integer >= 1, got: {value!r}")
+
+
+def share_snapshot(source_snapshot, account_ids):
+    """
+    Ensure the snapshot is shared with every target account.
+    Only the accounts that do not have createVolumePermission yet are added.
+    """
+    source_sharing = source_snapshot.describe_attribute(Attribute='createVolumePermission')
+    shared_with = {permission.get('UserId')
+                   for permission in source_sharing['CreateVolumePermissions']}
+    missing = sorted(set(account_ids) - shared_with)
+    if not missing:
+        print("Snapshot already shared with all target accounts")
+        return
+    print("Sharing with target accounts: " + ", ".join(missing))
     source_snapshot.modify_attribute(
         Attribute='createVolumePermission',
         OperationType='add',
-        UserIds=[TARGET_ACCOUNT_ID]
+        UserIds=missing
     )
 
-# Get session with target account
-target_session = role_arn_to_session(
-    RoleArn=ROLE_ON_TARGET_ACCOUNT,
-    RoleSessionName='share-admin-temp-session'
-)
-target_ec2 = target_session.resource('ec2', region_name=TARGET_REGION)
-
-# A shared snapshot, owned by source account
-shared_snapshot = target_ec2.Snapshot(source_ami.block_device_mappings[0]['Ebs']['SnapshotId'])
-
-# Ensure source snapshot is completed, cannot be copied otherwise
-if shared_snapshot.state != "completed":
-    print("Shared snapshot not in completed state, got: " + shared_snapshot.state)
-    exit(1)
-
-# Create a copy of the shared snapshot on the target account
-copy = shared_snapshot.copy(
-    SourceRegion=SOURCE_REGION,
-    Encrypted=True,
-)
-
-# Wait for the copy to complete
-copied_snapshot = target_ec2.Snapshot(copy['SnapshotId'])
-copied_snapshot.wait_until_completed()
-
-print("Created target-owned copy of shared snapshot with id: " + copy['SnapshotId'])
-
-# Optional: tag the created snapshot
-# copied_snapshot.create_tags(
-#     Tags=[
-#         {
-#             'Key': 'cost_centre',
-#             'Value': 'project abc',
-#         },
-#     ]
-# )
-
-# Create an AMI from the snapshot.
-# Modify the below if your configuration differs
-new_image = target_ec2.register_image(
-    Name='copy-' + copied_snapshot.snapshot_id,
-    Architecture='x86_64',
-    RootDeviceName='/dev/sda1',
-    BlockDeviceMappings=[
-        {
-            "DeviceName": "/dev/sda1",
-            "Ebs": {
-                "SnapshotId": copied_snapshot.snapshot_id,
-                "VolumeSize": copied_snapshot.volume_size,
-                "DeleteOnTermination": True,
-                "VolumeType": "gp2"
-            },
-        }
-    ],
-    VirtualizationType='hvm'
-)
-
-print("New AMI created ")
-
-# Optional: tag the created AMI
-# new_image.create_tags(
-#     Tags=[
-#         {
-#             'Key': 'cost_centre',
-#             'Value': 'project abc',
-#         },
-#     ]
-# )
-
-# Optional: Remove old snapshot and image
-# source_ami.deregister()
-# source_snapshot.delete()
\ No newline at end of file
+
+def copy_and_register(role_arn, snapshot_id, source_region, target_region, sts_client=None):
+    """
+    Copies the shared snapshot into the target account/region and registers
+    an AMI from the copy. Returns the id of the new AMI.
+    """
+    # Get session with target account
+    target_session = role_arn_to_session(
+        sts_client=sts_client,
+        RoleArn=role_arn,
+        RoleSessionName=SESSION_NAME
+    )
+
+    # A shared snapshot, owned by source account
+    shared_snapshot = target_session.resource('ec2', region_name=source_region).Snapshot(snapshot_id)
+
+    # Ensure source snapshot is completed, cannot be copied otherwise
+    if shared_snapshot.state != "completed":
+        raise RuntimeError("Shared snapshot not in completed state, got: " + shared_snapshot.state)
+
+    # Create a copy of the shared snapshot on the target account
+    target_ec2 = target_session.resource('ec2', region_name=target_region)
+    copy = target_ec2.meta.client.copy_snapshot(
+        SourceRegion=source_region,
+        SourceSnapshotId=snapshot_id,
+        Encrypted=True,
+    )
+
+    # Wait for the copy to complete
+    copied_snapshot = target_ec2.Snapshot(copy['SnapshotId'])
+    copied_snapshot.wait_until_completed()
+
+    print("Created target-owned copy of shared snapshot with id: " + copy['SnapshotId'])
+
+    # Optional: tag the created snapshot
+    # copied_snapshot.create_tags(
+    #     Tags=[
+    #         {
+    #             'Key': 'cost_centre',
+    #             'Value': 'project abc',
+    #         },
+    #     ]
+    # )
+
+    # Create an AMI from the snapshot.
+    # Modify the below if your configuration differs
+    new_image = target_ec2.register_image(
+        Name='copy-' + copied_snapshot.snapshot_id,
+        Architecture='x86_64',
+        RootDeviceName='/dev/sda1',
+        BlockDeviceMappings=[
+            {
+                "DeviceName": "/dev/sda1",
+                "Ebs": {
+                    "SnapshotId": copied_snapshot.snapshot_id,
+                    "VolumeSize": copied_snapshot.volume_size,
+                    "DeleteOnTermination": True,
+                    "VolumeType": "gp2"
+                },
+            }
+        ],
+        VirtualizationType='hvm'
+    )
+
+    # Optional: tag the created AMI
+    # new_image.create_tags(
+    #     Tags=[
+    #         {
+    #             'Key': 'cost_centre',
+    #             'Value': 'project abc',
+    #         },
+    #     ]
+    # )
+
+    return new_image.image_id
+
+
+def distribute(ami_id, config, targets):
+    """
+    Shares the AMI snapshot with every target account and runs the copy and
+    register steps for every (account, region) target concurrently.
+    Concurrency is bounded globally by max_workers and per account/region by
+    max_per_account and max_per_region. A target is only submitted once its
+    account and region are under their limits, so no worker sits waiting on
+    a limit while the targets of other accounts could run.
+    Returns a dict of (account_id, region) -> new AMI id or the raised error.
+    """
+    check_limits(config)
+    source_region = config.get('source_region', SOURCE_REGION)
+    source_ec2 = boto3.resource('ec2', region_name=source_region)
+    source_ami = source_ec2.Image(ami_id)
+    snapshot_id = source_ami.block_device_mappings[0]['Ebs']['SnapshotId']
+
+    share_snapshot(source_ec2.Snapshot(snapshot_id), {account_id for account_id, _, _ in targets})
+    # Clients are thread safe, creating them from the default session is not
+    sts_client = boto3.client('sts')
+
+    max_workers = config.get('max_workers', LIMITS['max_workers'])
+    max_per_account = config.get('max_per_account', LIMITS['max_per_account'])
+    max_per_region = config.get('max_per_region', LIMITS['max_per_region'])
+    per_account, per_region = Counter(), Counter()
+    pending = list(targets)
+    running = {}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for target in list(pending):
+                if len(running) >= max_workers:
+                    break
+                account_id, role_arn, region = target
+                if per_account[account_id] < max_per_account and per_region[region] < max_per_region:
+                    pending.remove(target)
+                    per_account[account_id] += 1
+                    per_region[region] += 1
+                    future = executor.submit(copy_and_register, role_arn, snapshot_id,
+                                             source_region, region, sts_client)
+                    running[future] = target
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                account_id, _, region = running.pop(future)
+                per_account[account_id] -= 1
+                per_region[region] -= 1
+                try:
+                    results[(account_id, region)] = future.result()
+                    print(f"New AMI created in {account_id}/{region}: {results[(account_id, region)]}")
+                except Exception as err:
+                    results[(account_id, region)] = err
+                    print(f"Failed to distribute AMI to {account_id}/{region}: {err}")
+    return results
+
+
+def main():
+    if len(argv) == 2:
+        config = {'source_region': SOURCE_REGION, 'max_workers': 1}
+        targets = [(TARGET_ACCOUNT_ID, ROLE_ON_TARGET_ACCOUNT, TARGET_REGION)]
+    elif len(argv) == 3:
+        try:
+            config, targets = load_targets(argv[2])
+        except ValueError as err:
+            print(f"Invalid config {argv[2]}: {err}")
+            exit(1)
+    else:
+        print('usage: share-ami.py [ami] [targets.json]')
+        exit(1)
+
+    results = distribute(argv[1], config, targets)
+    if any(isinstance(result, Exception) for result in results.values()):
+        exit(1)
+
+    # Optional: Remove old snapshot and image
+    # source_ami.deregister()
+    # source_snapshot.delete()
+
+
+if __name__ == '__main__':
+    main()
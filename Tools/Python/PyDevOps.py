@@ -1,11 +1,231 @@
 import boto3
 import argparse
+import gc
+import numpy as np
 import json
+import math
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
+from statistics import median
 from botocore.exceptions import BotoCoreError, ClientError
-from datetime import datetime, timezone
-import pprint as pp
+from datetime import datetime, timedelta, timezone
+
+
+class InstanceSpecCache:
+    """
+    InstanceSpecCache keeps the instance specifications on disk in a JSON file
+    keyed by region, so repeated runs do not have to call describe_instance_types.
+    Entries older than the TTL are still returned but reported as stale, so they
+    can be refreshed in the background. Instance types EC2 does not offer in a
+    region are kept as unavailable entries, so they are not requested again
+    before the TTL expires either.
+
+    Parameters:
+        - path (str): Path of the JSON cache file.
+        - ttl (int): Number of seconds an entry is considered fresh.
+    """
+
+    DEFAULT_PATH = os.path.join(
+        os.path.expanduser("~"), ".cache", "pydevops", "instance_specs.json"
+    )
+    DEFAULT_TTL = 7 * 24 * 3600
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def lookup(self, region, instance_types):
+        """
+        Looks up the specifications of the instance types in a region.
+
+        Returns:
+        - tuple: (specs, stale, missing) where specs is a dict of the cached
+          specifications, stale the cached types older than the TTL and missing
+          the types that are not cached at all. Fresh unavailable types are in
+          none of them.
+        """
+        specs, stale, missing = {}, [], []
+        now = time.time()
+        with self.lock:
+            entries = self.data.get(region, {})
+            for instance_type in instance_types:
+                entry = entries.get(instance_type)
+                if entry is None:
+                    missing.append(instance_type)
+                    continue
+                if now - entry["updated"] > self.ttl:
+                    stale.append(instance_type)
+                if not entry.get("unavailable"):
+                    specs[instance_type] = {"vcpus": entry["vcpus"], "memory": entry["memory"]}
+        return specs, stale, missing
+
+    def update(self, region, specs, unavailable=()):
+        """
+        Stores the specifications and the unavailable instance types of a region
+        and writes the cache file.
+        The file is written to a temporary file first and then renamed so a
+        concurrent run never reads a partial cache.
+        """
+        if not specs and not unavailable:
+            return
+        now = time.time()
+        with self.lock:
+            entries = self.data.setdefault(region, {})
+            for instance_type, spec in specs.items():
+                entries[instance_type] = dict(spec, updated=now)
+            for instance_type in unavailable:
+                entries[instance_type] = {"unavailable": True, "updated": now}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+
+
+class PriceSketch:
+    """
+    PriceSketch is a logarithmic histogram, in the spirit of DDSketch, that
+    answers weighted quantile queries with a bounded relative error. Its size
+    depends on the range of the prices, not on the number of prices added.
+
+    Parameters:
+        - relative_accuracy (float): The relative error of the returned quantiles.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_weight = 0.0
+        self.total_weight = 0.0
+
+    def add(self, value, weight=1.0):
+        if weight <= 0:
+            return
+        self.total_weight += weight
+        if value <= 0:
+            self.zero_weight += weight
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0.0) + weight
+
+    def quantile(self, q):
+        """
+        Returns the weighted q-quantile (0 <= q <= 1) or None when the sketch is empty.
+        """
+        if not self.total_weight:
+            return None
+        rank = q * self.total_weight
+        cumulative = self.zero_weight
+        if cumulative >= rank and self.zero_weight:
+            return 0.0
+        key = None
+        for key in sorted(self.bins):
+            cumulative += self.bins[key]
+            if cumulative >= rank:
+                break
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+class SpotPriceAggregator:
+    """
+    SpotPriceAggregator summarizes the spot price history of one instance type in
+    one availability zone over a time window, one record at a time, so the full
+    history never has to be kept in memory.
+
+    Every price is weighted by the time it was in effect: from its timestamp
+    until the next price change, clipped to the window. The records must be added
+    newest first, which is the order describe_spot_price_history returns them in.
+    A record newer than the previous one cannot be weighted without keeping the
+    history, it is left out and counted in out_of_order instead.
+
+    Parameters:
+        - start (datetime): Start of the time window.
+        - end (datetime): End of the time window.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.sketch = PriceSketch()
+        self.next_change = None
+        self.latest = None
+        self.minimum = None
+        self.maximum = None
+        self.weight = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.rises = 0
+        self.out_of_order = 0
+
+    def add(self, timestamp, price):
+        if self.next_change is None:
+            until = self.end
+            self.latest = price
+        else:
+            until, next_price = self.next_change
+            if timestamp > until:
+                # Keep the position in the stream, the next records stay correct
+                self.out_of_order += 1
+                return
+            if next_price > price:
+                self.rises += 1
+        self.next_change = (timestamp, price)
+
+        duration = (min(until, self.end) - max(timestamp, self.start)).total_seconds()
+        if duration <= 0:
+            return
+        self.minimum = price if self.minimum is None else min(self.minimum, price)
+        self.maximum = price if self.maximum is None else max(self.maximum, price)
+        # Weighted Welford update of the time-weighted mean and variance
+        self.weight += duration
+        delta = price - self.mean
+        self.mean += delta * duration / self.weight
+        self.m2 += duration * delta * (price - self.mean)
+        self.sketch.add(price, duration)
+
+    def quantile(self, q):
+        # The sketch is only accurate within a relative error, keep it in the observed range
+        return min(max(self.sketch.quantile(q), self.minimum), self.maximum)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: The time-weighted mean, p50 and p90 prices, min/max/latest prices,
+          the volatility (time-weighted coefficient of variation), the
+          interruption risk proxy (price rises per day) and the number of
+          records left out because they were out of order.
+        """
+        if not self.weight:
+            return {
+                "mean": self.latest, "p50": self.latest, "p90": self.latest,
+                "min": self.latest, "max": self.latest, "latest": self.latest,
+                "volatility": 0.0, "interruption_risk": 0.0,
+                "out_of_order": self.out_of_order,
+            }
+        days = max((self.end - self.start).total_seconds() / 86400, 1 / 24)
+        volatility = math.sqrt(max(self.m2, 0.0) / self.weight) / self.mean if self.mean else 0.0
+        return {
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "min": self.minimum,
+            "max": self.maximum,
+            "latest": self.latest,
+            "volatility": volatility,
+            "interruption_risk": self.rises / days,
+            "out_of_order": self.out_of_order,
+        }
 
 
 class EC2Analyzer:
@@ -17,61 +237,346 @@ class EC2Analyzer:
     Parameters:
         - region (str): The AWS region to query.
         - instance_types (list): A list of EC2 instance type strings.
+        - max_workers (int): Number of concurrent spot price requests.
+        - spec_cache (InstanceSpecCache): Optional on-disk cache of instance specifications.
     """
 
-    def __init__(self, region, instance_types):
+    # describe_instance_types accepts at most 100 instance types per request
+    INSTANCE_SPECS_CHUNK_SIZE = 100
+
+    # Number of instance types sent in a single spot price history shard
+    SPOT_PRICE_CHUNK_SIZE = 20
+
+    def __init__(self, region, instance_types, max_workers=8, spec_cache=None):
         self.region = region
         self.instance_types = instance_types
+        self.max_workers = max_workers
+        self.spec_cache = spec_cache
+        self.spec_refresh = None
         self.ec2_client = boto3.client("ec2", region_name=region)
         self.specs = {}
         self.prices = {}
+        self.az_prices = {}
+        self.price_stats = {}
+        self.az_history = {}
+        self.volatility = {}
+        self.interruption_risk = {}
+
+    def fetch_instance_specs(self, instance_types):
+        """
+        Requests the specifications (vCPUs and memory) of the instance types from
+        EC2 in batches of 100 using the describe_instance_types paginator.
+        The instance types an InvalidInstanceType error names are dropped and the
+        rest of the batch is requested again; any other failing batch is reported
+        and skipped instead of stopping the tool.
+
+        Returns:
+        - tuple: (specs, unavailable) where specs is a dict of instance type ->
+          {"vcpus", "memory"} and unavailable the list of the instance types EC2
+          does not offer in the region.
+        """
+        specs, unavailable = {}, []
+        paginator = self.ec2_client.get_paginator("describe_instance_types")
+        for i in range(0, len(instance_types), self.INSTANCE_SPECS_CHUNK_SIZE):
+            chunk = instance_types[i:i + self.INSTANCE_SPECS_CHUNK_SIZE]
+            while chunk:
+                try:
+                    for page in paginator.paginate(InstanceTypes=chunk):
+                        for instance in page["InstanceTypes"]:
+                            memory = instance["MemoryInfo"]["SizeInMiB"] / 1024
+                            specs[instance["InstanceType"]] = {
+                                "vcpus": instance["VCpuInfo"]["DefaultVCpus"],
+                                "memory": round(memory, 2),
+                            }
+                    break
+                except ClientError as error:
+                    invalid = self.invalid_instance_types(error, chunk)
+                    if not invalid:
+                        print(f"Error getting the instance specificaiton for {chunk}: {error}")
+                        break
+                    print(f"Instance types not available in {self.region}: {', '.join(invalid)}")
+                    unavailable.extend(invalid)
+                    chunk = [instance_type for instance_type in chunk if instance_type not in invalid]
+                except BotoCoreError as error:
+                    print(f"Error getting the instance specificaiton for {chunk}: {error}")
+                    break
+        return specs, unavailable
+
+    @staticmethod
+    def invalid_instance_types(error, instance_types):
+        """
+        Returns the instance types of the request an InvalidInstanceType error
+        names, e.g. "The following supplied instance types do not exist: [a, b]".
+        """
+        if error.response.get("Error", {}).get("Code") != "InvalidInstanceType":
+            return []
+        message = error.response["Error"].get("Message", "")
+        named = message[message.rfind("[") + 1:message.rfind("]")] if "[" in message else message
+        named = {name.strip(" '\"") for name in named.split(",")}
+        return [instance_type for instance_type in instance_types if instance_type in named]
+
+    def refresh_instance_specs(self, instance_types):
+        self.spec_cache.update(self.region, *self.fetch_instance_specs(instance_types))
 
     def get_instance_specs(self):
         """
         Retrieves the specifications (vCPUs and memory) for each EC2 instance type
         in the provided list. Populates the self.specs dictionary with the data.
+
+        With a spec cache only the types missing from the cache are requested;
+        stale entries are used as they are and refreshed in a background thread,
+        see wait_for_spec_refresh.
+        """
+        if self.spec_cache is None:
+            self.specs.update(self.fetch_instance_specs(self.instance_types)[0])
+            return
+
+        specs, stale, missing = self.spec_cache.lookup(self.region, self.instance_types)
+        if missing:
+            fetched, unavailable = self.fetch_instance_specs(missing)
+            self.spec_cache.update(self.region, fetched, unavailable)
+            specs.update(fetched)
+        if stale:
+            self.spec_refresh = threading.Thread(
+                target=self.refresh_instance_specs, args=(stale,)
+            )
+            self.spec_refresh.start()
+        self.specs.update(specs)
+
+    def wait_for_spec_refresh(self):
+        """
+        Waits for the background refresh of stale cached specifications to finish.
+        """
+        if self.spec_refresh is not None:
+            self.spec_refresh.join()
+            self.spec_refresh = None
+
+    def get_availability_zones(self):
+        """
+        Retrieves the names of the available availability zones in the region.
+        A failing request is reported and raised again.
+
+        Returns:
+        - list: A list of availability zone names.
         """
         try:
-            response = self.ec2_client.describe_instance_types(
-                InstanceTypes=self.instance_types
+            response = self.ec2_client.describe_availability_zones(
+                Filters=[{"Name": "state", "Values": ["available"]}]
             )
         except (BotoCoreError, ClientError) as error:
-            print(f"Error getting the instance specificaiton: {error}")
-            sys.exit(1)
+            print(f"Error getting the availability zones of {self.region}: {error}")
+            raise
+        return [zone["ZoneName"] for zone in response["AvailabilityZones"]]
+
+    def _collect_spot_prices(self, availability_zone, instance_types):
+        """
+        Walks every page of the spot price history for one shard (an availability
+        zone and a chunk of instance types) and keeps the latest price per type.
+
+        Returns:
+        - dict: instance type -> (timestamp, spot price) for the availability zone.
+        """
+        latest = {}
+        paginator = self.ec2_client.get_paginator("describe_spot_price_history")
+        pages = paginator.paginate(
+            InstanceTypes=instance_types,
+            AvailabilityZone=availability_zone,
+            ProductDescriptions=["Linux/UNIX"],
+            StartTime=datetime.now(timezone.utc),
+        )
+        for page in pages:
+            for price_info in page["SpotPriceHistory"]:
+                instance_type = price_info["InstanceType"]
+                timestamp = price_info["Timestamp"]
+                if instance_type not in latest or timestamp > latest[instance_type][0]:
+                    latest[instance_type] = (timestamp, float(price_info["SpotPrice"]))
+        return latest
+
+    def _collect_spot_price_history(self, availability_zone, instance_types, start, end):
+        """
+        Streams every page of the spot price history of one shard over the time
+        window into one SpotPriceAggregator per instance type.
 
-        for instance in response["InstanceTypes"]:
-            # print(instance)
-            instance_type = instance["InstanceType"]
-            vcpus = instance["VCpuInfo"]["DefaultVCpus"]
-            # print(instance["MemoryInfo"]["SizeInMiB"])
-            memory = instance["MemoryInfo"]["SizeInMiB"] / 1024
-            self.specs[instance_type] = {
-                "vcpus": vcpus,
-                "memory": round(memory, 2),
+        Returns:
+        - dict: instance type -> SpotPriceAggregator for the availability zone.
+        """
+        aggregators = {}
+        paginator = self.ec2_client.get_paginator("describe_spot_price_history")
+        pages = paginator.paginate(
+            InstanceTypes=instance_types,
+            AvailabilityZone=availability_zone,
+            ProductDescriptions=["Linux/UNIX"],
+            StartTime=start,
+            EndTime=end,
+        )
+        for page in pages:
+            for price_info in page["SpotPriceHistory"]:
+                instance_type = price_info["InstanceType"]
+                if instance_type not in aggregators:
+                    aggregators[instance_type] = SpotPriceAggregator(start, end)
+                aggregators[instance_type].add(
+                    price_info["Timestamp"], float(price_info["SpotPrice"])
+                )
+        for instance_type, aggregator in aggregators.items():
+            if aggregator.out_of_order:
+                print(
+                    f"Warning: {aggregator.out_of_order} out of order spot price records left out "
+                    f"for {instance_type} in {availability_zone}"
+                )
+        return aggregators
+
+    def _run_shards(self, collect, *args):
+        """
+        Runs collect(availability_zone, instance_types, *args) concurrently for every
+        shard of availability zone and chunk of instance types.
+        A failing request is reported and raised again.
+
+        Returns:
+        - list: (availability zone, collect result) for every shard.
+        """
+        shards = [
+            (availability_zone, self.instance_types[i:i + self.SPOT_PRICE_CHUNK_SIZE])
+            for availability_zone in self.get_availability_zones()
+            for i in range(0, len(self.instance_types), self.SPOT_PRICE_CHUNK_SIZE)
+        ]
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return list(
+                    executor.map(lambda shard: (shard[0], collect(*shard, *args)), shards)
+                )
+        except (BotoCoreError, ClientError) as error:
+            print(f"Error fetching spot prices in {self.region}: {error}")
+            raise
+
+    def _set_price_stats(self):
+        for instance_type, zone_prices in self.az_prices.items():
+            values = list(zone_prices.values())
+            self.price_stats[instance_type] = {
+                "min": min(values),
+                "median": median(values),
+                "max": max(values),
             }
-            # print(self.specs)
+            self.prices[instance_type] = self.price_stats[instance_type]["min"]
 
     def get_spot_prices(self):
         """
         Retrieves the latest spot prices for each EC2 instance type in the list.
-        Populates the self.prices dictionary with the data.
+        The requests are sharded by availability zone and chunks of instance types,
+        run concurrently and paginated until NextToken is exhausted.
+        Populates self.az_prices with the price per availability zone,
+        self.price_stats with the min/median/max over the availability zones and
+        self.prices with the lowest price of each instance type.
         """
-        try:
-            response = self.ec2_client.describe_spot_price_history(
-                InstanceTypes=self.instance_types,
-                # MaxResults=len(self.instance_types),
-                ProductDescriptions=["Linux/UNIX"],
-                StartTime=datetime.now(timezone.utc),
+        for availability_zone, latest in self._run_shards(self._collect_spot_prices):
+            for instance_type, (_, spot_price) in latest.items():
+                self.az_prices.setdefault(instance_type, {})[availability_zone] = spot_price
+        self._set_price_stats()
+
+    def get_spot_price_history(self, lookback_hours, price_metric="mean"):
+        """
+        Retrieves the spot price history of each EC2 instance type over the last
+        lookback_hours and summarizes it per availability zone while streaming the
+        pages, see SpotPriceAggregator.
+        Populates self.az_history with the statistics per availability zone and
+        self.volatility and self.interruption_risk with the volatility and the
+        price rises per day of the cheapest availability zone.
+        self.az_prices, self.price_stats and self.prices are filled like
+        get_spot_prices, using price_metric (mean, p50 or p90) as the price.
+        """
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(hours=lookback_hours)
+        for availability_zone, aggregators in self._run_shards(
+            self._collect_spot_price_history, start, end
+        ):
+            for instance_type, aggregator in aggregators.items():
+                stats = aggregator.stats()
+                self.az_history.setdefault(instance_type, {})[availability_zone] = stats
+                self.az_prices.setdefault(instance_type, {})[availability_zone] = stats[price_metric]
+        self._set_price_stats()
+
+        for instance_type, zone_prices in self.az_prices.items():
+            cheapest = min(zone_prices, key=zone_prices.get)
+            self.volatility[instance_type] = self.az_history[instance_type][cheapest]["volatility"]
+            self.interruption_risk[instance_type] = (
+                self.az_history[instance_type][cheapest]["interruption_risk"]
             )
-            pp.pprint(response)
-        except (BotoCoreError, ClientError) as error:
-            print(f"Error fetching spot prices: {error}")
-            sys.exit(1)
 
-        for price_info in response["SpotPriceHistory"]:
-            instance_type = price_info["InstanceType"]
-            spot_price = float(price_info["SpotPrice"])
-            self.prices[instance_type] = spot_price
+
+class ScoringEngine:
+    """
+    ScoringEngine holds the specifications and spot prices of every scored row in
+    NumPy arrays and computes the weighted cost-effectiveness scores in a
+    vectorized way.
+
+    score = (vcpu * vCPUs + memory * memory) / price ** price_weight
+            / (1 + volatility * price_volatility)
+            / (1 + interruption * price_rises_per_day)
+
+    With the default weights the score is the original (vCPUs + memory) / price.
+
+    Parameters:
+        - keys (list): The key of each row, an instance type or a placement tuple.
+        - vcpus (sequence): The number of vCPUs of each row.
+        - memory (sequence): The memory in GiB of each row.
+        - prices (sequence): The spot price of each row.
+        - volatility (sequence): Optional relative price volatility of each row.
+        - interruption_risk (sequence): Optional price rises per day of each row.
+    """
+
+    DEFAULT_WEIGHTS = {
+        "vcpu": 1.0, "memory": 1.0, "price": 1.0, "volatility": 0.0, "interruption": 0.0,
+    }
+
+    def __init__(self, keys, vcpus, memory, prices, volatility=None, interruption_risk=None):
+        self.keys = keys
+        self.vcpus = np.asarray(vcpus, dtype=np.float64)
+        self.memory = np.asarray(memory, dtype=np.float64)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        if volatility is None:
+            self.volatility = np.zeros_like(self.prices)
+        else:
+            self.volatility = np.asarray(volatility, dtype=np.float64)
+        if interruption_risk is None:
+            self.interruption_risk = np.zeros_like(self.prices)
+        else:
+            self.interruption_risk = np.asarray(interruption_risk, dtype=np.float64)
+        self.scores = None
+
+    def score(self, weights=None):
+        """
+        Computes the weighted score of every row.
+
+        Returns:
+        - ndarray: The score of each row.
+        """
+        weights = dict(self.DEFAULT_WEIGHTS, **(weights or {}))
+        compute_units = weights["vcpu"] * self.vcpus + weights["memory"] * self.memory
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.scores = (
+                compute_units
+                / np.power(self.prices, weights["price"])
+                / (1.0 + weights["volatility"] * self.volatility)
+                / (1.0 + weights["interruption"] * self.interruption_risk)
+            )
+        return self.scores
+
+    def rank(self, top=None):
+        """
+        Orders the rows by descending score. When only the top N rows are needed
+        they are selected with a partial sort before sorting the selection.
+
+        Returns:
+        - ndarray: The row indices in ranking order.
+        """
+        if self.scores is None:
+            self.score()
+        negated = -self.scores
+        if top is None or top >= len(negated):
+            return np.argsort(negated, kind="stable")
+        if top <= 0:
+            return np.arange(0)
+        selected = np.argpartition(negated, top - 1)[:top]
+        return selected[np.argsort(negated[selected], kind="stable")]
 
 
 class CostEffectivenessCalculator:
@@ -82,44 +587,228 @@ class CostEffectivenessCalculator:
     Parameters:
         - specs (dict): A dictionary containing instance specifications.
         - prices (dict): A dictionary containing spot prices.
+        - price_stats (dict): Optional min/median/max spot prices per instance type.
+        - placements (dict): Optional spot prices keyed by (region, availability zone,
+          instance type). When given, every placement is ranked instead of the
+          per instance type prices.
+        - weights (dict): Optional ScoringEngine weights (vcpu, memory, price,
+          volatility, interruption).
+        - volatility (dict): Optional relative price volatility, keyed like the
+          prices or the placements.
+        - interruption_risk (dict): Optional price rises per day, keyed like the
+          prices or the placements.
     """
-    def __init__(self, specs, prices):
+    def __init__(self, specs, prices, price_stats=None, placements=None,
+                 weights=None, volatility=None, interruption_risk=None):
         self.specs = specs
         self.prices = prices
+        self.price_stats = price_stats or {}
+        self.placements = placements or {}
+        self.weights = weights
+        self.volatility = volatility or {}
+        self.interruption_risk = interruption_risk or {}
+        self.engine = None
+        self.instance_types = self.regions = self.availability_zones = None
         self.results = []
 
+    @classmethod
+    def from_analyzers(cls, analyzers, weights=None):
+        """
+        Merges the specifications and per availability zone spot prices of
+        several regional EC2Analyzer instances into a single calculator.
+
+        Returns:
+        - CostEffectivenessCalculator: A calculator ranking every placement.
+        """
+        specs = {}
+        placements = {}
+        volatility = {}
+        interruption_risk = {}
+        for analyzer in analyzers:
+            specs.update(analyzer.specs)
+            for instance_type, zone_prices in analyzer.az_prices.items():
+                for availability_zone, spot_price in zone_prices.items():
+                    placements[(analyzer.region, availability_zone, instance_type)] = spot_price
+            for instance_type, zone_history in analyzer.az_history.items():
+                for availability_zone, stats in zone_history.items():
+                    key = (analyzer.region, availability_zone, instance_type)
+                    volatility[key] = stats["volatility"]
+                    interruption_risk[key] = stats["interruption_risk"]
+        return cls(specs, {}, placements=placements, weights=weights, volatility=volatility,
+                   interruption_risk=interruption_risk)
+
     def calculate(self):
         """
-        Calculates the cost-effectiveness score for each instance type and
-        appends the results to the self.results list.
+        Calculates the cost-effectiveness score for each instance type, or each
+        placement, with a ScoringEngine. The results are only built for the rows
+        returned by get_ranked_results or get_ranked_columns.
         """
+        if self.placements:
+            self.calculate_placements()
+            return
+
+        keys = []
         for instance_type in self.specs:
-            vcpus = self.specs[instance_type]["vcpus"]
-            memory = self.specs[instance_type]["memory"]
-            spot_price = self.prices.get(instance_type)
-            if spot_price is None:
+            if self.prices.get(instance_type) is None:
                 print(f"No price available for {instance_type}. Skipping...")
                 continue
-            total_compute_units = vcpus + memory
-            cost_effectiveness = total_compute_units / spot_price
-            self.results.append(
-                {
-                    "InstanceType": instance_type,
-                    "vCPUs": vcpus,
-                    "Memory (GiB)": memory,
-                    "SpotPrice": spot_price,
-                    "CostEffectiveness": round(cost_effectiveness, 2),
-                }
-            )
+            keys.append(instance_type)
+        prices = np.fromiter((self.prices[key] for key in keys), np.float64, len(keys))
+        self.build_engine(keys, keys, prices)
+
+    def calculate_placements(self):
+        """
+        Calculates the cost-effectiveness score for each (region, availability zone,
+        instance type) placement with a ScoringEngine.
+        """
+        for instance_type in {key[2] for key in self.placements} - self.specs.keys():
+            print(f"No specification available for {instance_type}. Skipping...")
+        keys = [key for key in self.placements if key[2] in self.specs]
+        if len(keys) == len(self.placements):
+            prices = np.fromiter(self.placements.values(), np.float64, len(keys))
+        else:
+            prices = np.fromiter((self.placements[key] for key in keys), np.float64, len(keys))
+        self.regions = np.array(list(map(itemgetter(0), keys)), dtype=object)
+        self.availability_zones = np.array(list(map(itemgetter(1), keys)), dtype=object)
+        self.build_engine(keys, list(map(itemgetter(2), keys)), prices)
 
-    def get_ranked_results(self):
+    def build_engine(self, keys, instance_types, prices):
+        """
+        Builds the columnar arrays of the rows and scores them. The specifications
+        are stored once per instance type and gathered for every row by index.
+        prices is the array of the spot prices of the rows.
+        """
+        type_index = {instance_type: i for i, instance_type in enumerate(self.specs)}
+        spec_vcpus = np.fromiter(
+            (spec["vcpus"] for spec in self.specs.values()), np.float64, len(self.specs)
+        )
+        spec_memory = np.fromiter(
+            (spec["memory"] for spec in self.specs.values()), np.float64, len(self.specs)
+        )
+        rows = np.fromiter(map(type_index.__getitem__, instance_types), np.intp, len(keys))
+        self.instance_types = np.array(instance_types, dtype=object)
+        self.engine = ScoringEngine(
+            keys,
+            spec_vcpus[rows],
+            spec_memory[rows],
+            prices,
+            self.optional_column(self.volatility, keys),
+            self.optional_column(self.interruption_risk, keys),
+        )
+        self.engine.score(self.weights)
+
+    @staticmethod
+    def optional_column(values, keys):
+        if not values:
+            return None
+        return np.fromiter((values.get(key, 0.0) for key in keys), np.float64, len(keys))
+
+    @staticmethod
+    def round_scores(scores):
+        """
+        Rounds the scores to 2 decimals like round() does. np.round only differs
+        from it when score * 100 is exactly halfway, those few are rounded again.
+        """
+        rounded = np.round(scores, 2)
+        halfway = np.flatnonzero(np.abs(np.mod(scores * 100, 1) - 0.5) < 1e-9)
+        rounded[halfway] = [round(score, 2) for score in scores[halfway].tolist()]
+        return rounded.tolist()
+
+    def make_columns(self, order):
+        """
+        Gathers the result columns of the ranked rows from the engine arrays by
+        index and converts each of them to a Python list at once.
+
+        Returns:
+        - dict: column name -> list of the values in ranking order.
+        """
+        prices = self.engine.prices[order].tolist()
+        columns = {
+            "InstanceType": self.instance_types[order].tolist(),
+            "vCPUs": self.engine.vcpus[order].astype(np.int64).tolist(),
+            "Memory (GiB)": self.engine.memory[order].tolist(),
+            "SpotPrice": prices,
+            "CostEffectiveness": self.round_scores(self.engine.scores[order]),
+        }
+        if self.placements:
+            columns["Region"] = self.regions[order].tolist()
+            columns["AvailabilityZone"] = self.availability_zones[order].tolist()
+        else:
+            stats = [self.price_stats.get(instance_type, {}) for instance_type in columns["InstanceType"]]
+            columns["MedianPrice"] = [
+                stat.get("median", price) for stat, price in zip(stats, prices)
+            ]
+            columns["MaxPrice"] = [stat.get("max", price) for stat, price in zip(stats, prices)]
+        return columns
+
+    def get_ranked_columns(self, top=None):
+        """
+        Ranks the calculated rows like get_ranked_results but returns the results
+        as columns, without building a dictionary per row.
+
+        Parameters:
+        - top (int): Optional number of best results to return, selected with a partial sort.
+
+        Returns:
+        - dict: column name -> list of the values in ranking order.
+        """
+        if self.engine is None:
+            results = self.get_ranked_results(top)
+            return {name: [res[name] for res in results] for name in (results[0] if results else {})}
+        return self.make_columns(self.engine.rank(top))
+
+    def get_ranked_results(self, top=None):
         """
         Sorts the calculated results in descending order based on the cost-effectiveness score.
 
+        Parameters:
+        - top (int): Optional number of best results to return, selected with a partial sort.
+
         Returns:
         - list: A sorted list of dictionaries containing the results.
         """
-        return sorted(self.results, key=itemgetter("CostEffectiveness"), reverse=True)
+        if self.engine is None:
+            return sorted(self.results, key=itemgetter("CostEffectiveness"), reverse=True)[:top]
+
+        columns = self.get_ranked_columns(top)
+        rows = zip(
+            columns["InstanceType"], columns["vCPUs"], columns["Memory (GiB)"],
+            columns["SpotPrice"], columns["CostEffectiveness"],
+            *((columns["Region"], columns["AvailabilityZone"]) if self.placements
+              else (columns["MedianPrice"], columns["MaxPrice"])),
+        )
+        # The result dictionaries hold no reference cycles, pausing the cyclic
+        # garbage collector saves its passes over the growing result list
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if self.placements:
+                self.results = [
+                    {"InstanceType": instance_type, "vCPUs": vcpus, "Memory (GiB)": memory,
+                     "SpotPrice": price, "CostEffectiveness": score,
+                     "Region": region, "AvailabilityZone": availability_zone}
+                    for instance_type, vcpus, memory, price, score, region, availability_zone in rows
+                ]
+            else:
+                self.results = [
+                    {"InstanceType": instance_type, "vCPUs": vcpus, "Memory (GiB)": memory,
+                     "SpotPrice": price, "CostEffectiveness": score,
+                     "MedianPrice": median_price, "MaxPrice": max_price}
+                    for instance_type, vcpus, memory, price, score, median_price, max_price in rows
+                ]
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return self.results
+
+
+class WeightsAction(argparse.Action):
+    """
+    Collects the parsed name=value pairs of --weights into a dictionary.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, dict(values))
 
 
 class EC2SpotInstanceCostEffectivenessTool:
@@ -132,7 +821,25 @@ class EC2SpotInstanceCostEffectivenessTool:
     def __init__(self):
         self.args = self.parse_arguments()
         self.instance_types = self.get_instance_types()
-        self.analyzer = EC2Analyzer(self.args.region, self.instance_types)
+        spec_cache = None
+        if not self.args.no_spec_cache:
+            spec_cache = InstanceSpecCache(
+                self.args.spec_cache, self.args.spec_cache_ttl * 3600
+            )
+        if self.args.regions:
+            # One analyzer, and so one client, per region. The clients are created
+            # here because creating them from the default session is not thread safe.
+            self.analyzers = [
+                EC2Analyzer(region, self.instance_types, self.args.max_workers, spec_cache)
+                for region in self.get_regions()
+            ]
+        else:
+            self.analyzers = [
+                EC2Analyzer(
+                    self.args.region, self.instance_types, self.args.max_workers, spec_cache
+                )
+            ]
+        self.analyzer = self.analyzers[0]
         self.calculator = None
 
     def parse_arguments(self):
@@ -144,7 +851,61 @@ class EC2SpotInstanceCostEffectivenessTool:
         - Namespace: An object containing parsed command-line arguments.
         """
         parser = argparse.ArgumentParser(description="Cost Effectiveness Calculator")
-        parser.add_argument("--region", required=True, help="AWS Region")
+        region_group = parser.add_mutually_exclusive_group(required=True)
+        region_group.add_argument("--region", help="AWS Region")
+        region_group.add_argument(
+            "--regions",
+            nargs="+",
+            help="List of AWS Regions to rank together, or 'all' for every enabled region",
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            default=8,
+            help="Number of concurrent spot price requests",
+        )
+        parser.add_argument(
+            "--spec-cache",
+            default=InstanceSpecCache.DEFAULT_PATH,
+            help="Path to the instance specification cache file",
+        )
+        parser.add_argument(
+            "--spec-cache-ttl",
+            type=float,
+            default=InstanceSpecCache.DEFAULT_TTL / 3600,
+            help="Hours before cached instance specifications are refreshed",
+        )
+        parser.add_argument(
+            "--no-spec-cache",
+            action="store_true",
+            help="Always request the instance specifications from EC2",
+        )
+        parser.add_argument(
+            "--weights",
+            nargs="+",
+            type=self.parse_weight,
+            action=WeightsAction,
+            default=None,
+            help="Score weights as name=value, names: vcpu, memory, price, volatility, interruption",
+        )
+        parser.add_argument(
+            "--history-hours",
+            type=float,
+            default=None,
+            help="Rank on the spot price history of the last N hours instead of the current price",
+        )
+        parser.add_argument(
+            "--history-price",
+            choices=["mean", "p50", "p90"],
+            default="mean",
+            help="Price used for the ranking in history mode (time-weighted)",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=None,
+            help="Only display the N most cost-effective results",
+        )
 
         group = parser.add_mutually_exclusive_group(required=True)
         group.add_argument(
@@ -158,6 +919,24 @@ class EC2SpotInstanceCostEffectivenessTool:
         )
         return parser.parse_args()
 
+    @staticmethod
+    def parse_weight(value):
+        """
+        Parses a name=value score weight.
+
+        Returns:
+        - tuple: The weight name and its float value.
+        """
+        name, _, weight = value.partition("=")
+        if name not in ScoringEngine.DEFAULT_WEIGHTS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown weight {name}, expected one of {', '.join(ScoringEngine.DEFAULT_WEIGHTS)}"
+            )
+        try:
+            return name, float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid value for weight {name}: {weight}")
+
     def get_instance_types(self):
         """
         Retrieves the list of EC2 instance types either directly from command-line
@@ -185,24 +964,101 @@ class EC2SpotInstanceCostEffectivenessTool:
             print("No instance types provid.")
             sys.exit(1)
 
+    def get_regions(self):
+        """
+        Retrieves the list of AWS regions from the command-line arguments.
+        'all' is expanded to every region enabled for the account.
+
+        Returns:
+        - list: A list of AWS region names.
+        """
+        if self.args.regions != ["all"]:
+            return self.args.regions
+        try:
+            response = boto3.client("ec2").describe_regions()
+        except (BotoCoreError, ClientError) as error:
+            print(f"Error getting the enabled regions: {error}")
+            sys.exit(1)
+        return [region["RegionName"] for region in response["Regions"]]
+
+    def analyze(self, analyzer):
+        """
+        Retrieves the specifications and spot prices of one region.
+        When a request fails the tool exits with a single --region, with --regions
+        the region is left out of the ranking.
+
+        Returns:
+        - EC2Analyzer: The analyzer, or None when its region failed.
+        """
+        try:
+            analyzer.get_instance_specs()
+            if self.args.history_hours:
+                analyzer.get_spot_price_history(self.args.history_hours, self.args.history_price)
+            else:
+                analyzer.get_spot_prices()
+        except (BotoCoreError, ClientError):
+            if not self.args.regions:
+                sys.exit(1)
+            print(f"Leaving {analyzer.region} out of the ranking")
+            return None
+        return analyzer
+
     def run(self):
-        self.analyzer.get_instance_specs()
-        self.analyzer.get_spot_prices()
-        self.calculator = CostEffectivenessCalculator(
-            self.analyzer.specs, self.analyzer.prices
+        if not self.args.regions:
+            self.analyze(self.analyzer)
+            self.calculator = CostEffectivenessCalculator(
+                self.analyzer.specs,
+                self.analyzer.prices,
+                self.analyzer.price_stats,
+                weights=self.args.weights,
+                volatility=self.analyzer.volatility,
+                interruption_risk=self.analyzer.interruption_risk,
+            )
+            self.calculator.calculate()
+            self.print_results(self.calculator.get_ranked_columns(self.args.top))
+        else:
+            with ThreadPoolExecutor(max_workers=len(self.analyzers)) as executor:
+                analyzed = [
+                    analyzer
+                    for analyzer in executor.map(self.analyze, self.analyzers)
+                    if analyzer is not None
+                ]
+            if not analyzed:
+                print("No region could be analyzed")
+                sys.exit(1)
+            self.calculator = CostEffectivenessCalculator.from_analyzers(
+                analyzed, self.args.weights
+            )
+            self.calculator.calculate()
+            self.print_placement_results(self.calculator.get_ranked_columns(self.args.top))
+
+        for analyzer in self.analyzers:
+            analyzer.wait_for_spec_refresh()
+
+    def print_results(self, columns):
+        print(
+            f"{'InstanceType':15} {'vCPUs':5} {'Memory (GiB)':12} {'SpotPrice':10} {'MedianPrice':11} {'MaxPrice':10} {'CostEffectiveness':18}"
         )
-        self.calculator.calculate()
-        results = self.calculator.get_ranked_results()
-        self.print_results(results)
+        print("-" * 87)
+        for instance_type, vcpus, memory, price, median_price, max_price, score in zip(
+            columns["InstanceType"], columns["vCPUs"], columns["Memory (GiB)"], columns["SpotPrice"],
+            columns["MedianPrice"], columns["MaxPrice"], columns["CostEffectiveness"],
+        ):
+            print(
+                f"{instance_type:15} {vcpus:5} {memory:12.2f} {price:10.4f} {median_price:11.4f} {max_price:10.4f} {score:18}"
+            )
 
-    def print_results(self, results):
+    def print_placement_results(self, columns):
         print(
-            f"{'InstanceType':15} {'vCPUs':5} {'Memory (GiB)':12} {'SpotPrice':10} {'CostEffectiveness':18}"
+            f"{'Region':15} {'AvailabilityZone':17} {'InstanceType':15} {'vCPUs':5} {'Memory (GiB)':12} {'SpotPrice':10} {'CostEffectiveness':18}"
         )
-        print("-" * 65)
-        for res in results:
+        print("-" * 97)
+        for region, availability_zone, instance_type, vcpus, memory, price, score in zip(
+            columns["Region"], columns["AvailabilityZone"], columns["InstanceType"], columns["vCPUs"],
+            columns["Memory (GiB)"], columns["SpotPrice"], columns["CostEffectiveness"],
+        ):
             print(
-                f"{res['InstanceType']:15} {res['vCPUs']:5} {res['Memory (GiB)']:12.2f} {res['SpotPrice']:10.4f} {res['CostEffectiveness']:18}"
+                f"{region:15} {availability_zone:17} {instance_type:15} {vcpus:5} {memory:12.2f} {price:10.4f} {score:18}"
             )
 
 
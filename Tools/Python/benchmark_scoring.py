@@ -0,0 +1,129 @@
+import argparse
+import random
+import time
+from operator import itemgetter
+
+from PyDevOps import CostEffectivenessCalculator
+
+
+def generate_placements(regions, zones, instance_types, seed=0):
+    """
+    Generates synthetic specifications and spot prices for every
+    (region, availability zone, instance type) placement.
+
+    Returns:
+    - tuple: (specs, placements) in the format used by CostEffectivenessCalculator.
+    """
+    rng = random.Random(seed)
+    specs = {
+        f"type{i}.large": {
+            "vcpus": rng.choice([1, 2, 4, 8, 16, 32, 64]),
+            "memory": round(rng.uniform(0.5, 512), 2),
+        }
+        for i in range(instance_types)
+    }
+    placements = {
+        (f"region-{r}", f"region-{r}{chr(97 + z)}", instance_type): round(rng.uniform(0.001, 5), 4)
+        for r in range(regions)
+        for z in range(zones)
+        for instance_type in specs
+    }
+    return specs, placements
+
+
+def loop_rank(specs, placements):
+    """
+    The dictionary based scoring loop CostEffectivenessCalculator used before
+    the ScoringEngine, kept as the reference implementation.
+    """
+    results = []
+    for (region, availability_zone, instance_type), spot_price in placements.items():
+        spec = specs.get(instance_type)
+        if spec is None:
+            continue
+        cost_effectiveness = (spec["vcpus"] + spec["memory"]) / spot_price
+        results.append(
+            {
+                "Region": region,
+                "AvailabilityZone": availability_zone,
+                "InstanceType": instance_type,
+                "vCPUs": spec["vcpus"],
+                "Memory (GiB)": spec["memory"],
+                "SpotPrice": spot_price,
+                "CostEffectiveness": round(cost_effectiveness, 2),
+            }
+        )
+    return sorted(results, key=itemgetter("CostEffectiveness"), reverse=True)
+
+
+def engine_rank(specs, placements, top=None):
+    calculator = CostEffectivenessCalculator(specs, {}, placements=placements)
+    calculator.calculate()
+    return calculator.get_ranked_results(top)
+
+
+def engine_columns(specs, placements, top=None):
+    """
+    The ranking as the CLI prints it, in columns without a dictionary per row.
+    """
+    calculator = CostEffectivenessCalculator(specs, {}, placements=placements)
+    calculator.calculate()
+    return calculator.get_ranked_columns(top)
+
+
+def engine_scoring(engine, top=None):
+    engine.score()
+    return engine.rank(top)
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ScoringEngine against the dictionary scoring loop"
+    )
+    parser.add_argument("--regions", type=int, default=17, help="Number of regions")
+    parser.add_argument("--zones", type=int, default=6, help="Availability zones per region")
+    parser.add_argument("--instance-types", type=int, default=800, help="Number of instance types")
+    parser.add_argument("--top", type=int, default=20, help="Size of the partial ranking")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per implementation")
+    args = parser.parse_args()
+
+    specs, placements = generate_placements(args.regions, args.zones, args.instance_types)
+    print(f"Scoring {len(placements)} placements, best of {args.repeat} runs")
+
+    loop_time, loop_results = best_of(args.repeat, loop_rank, specs, placements)
+    columns_time, columns = best_of(args.repeat, engine_columns, specs, placements)
+    engine_time, engine_results = best_of(args.repeat, engine_rank, specs, placements)
+    top_time, top_results = best_of(args.repeat, engine_rank, specs, placements, args.top)
+
+    calculator = CostEffectivenessCalculator(specs, {}, placements=placements)
+    calculator.calculate()
+    scoring_time, _ = best_of(args.repeat, engine_scoring, calculator.engine, args.top)
+
+    loop_scores = [res["CostEffectiveness"] for res in loop_results]
+    assert loop_scores == [res["CostEffectiveness"] for res in engine_results]
+    assert loop_scores == columns["CostEffectiveness"]
+    assert loop_scores[:args.top] == [res["CostEffectiveness"] for res in top_results]
+
+    print(f"{'Implementation':25} {'Seconds':>10} {'Speedup':>8}")
+    print("-" * 45)
+    for name, elapsed in (
+        ("loop (full ranking)", loop_time),
+        ("engine (full ranking)", columns_time),
+        ("engine (result dicts)", engine_time),
+        (f"engine (top {args.top})", top_time),
+        (f"scoring only (top {args.top})", scoring_time),
+    ):
+        print(f"{name:25} {elapsed:10.4f} {loop_time / elapsed:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
-import yaml
-from jinja2 import Environment, FileSystemLoader
-import boto3
 import os
 import logging
 import argparse
-from git import Repo
+from render import create_environment, render, render_all, find_confs, watch
+
+# boto3 and the deploy module are imported in the functions that need them,
+# so rendering never pays for loading the AWS libraries.
 
 logging.basicConfig(level=logging.INFO)
 
 dir_path = os.getcwd()
 # You can use the git branch name if the directory is from the git.
+# from git import Repo
 # repo = Repo(dir_path)
 # branch = repo.active_branch
 # branch_name = str(branch)
@@ -22,37 +23,42 @@ dir_path = os.getcwd()
 
 def gen_template(fileconf):
     try:
-        with open(f'{dir_path}/conf/{fileconf}') as file:
-            conf_var = yaml.load(file, Loader=yaml.FullLoader)
         # conf_var['user_data']['branch'] = branch_name
-        file_loader = FileSystemLoader([os.path.join(dir_path, 'templates')])
-        env = Environment(loader=file_loader)
-        jinja_template = env.get_template(conf_var['template_path'])
-        output = jinja_template.render(conf_var)
-        return output
+        return render(create_environment(dir_path), dir_path, fileconf)
 
     except Exception as err:
         logging.info("Can't generate pipeline")
         logging.info(err)
 
 
-def save_template(template):
-    gen_output = gen_template(template)
-    with open(f'{dir_path}/{template}', "w") as fh:
-        fh.write(gen_output)
-    return gen_output
+def save_template(template, incremental=False):
+    if render_all(dir_path, incremental=incremental, workers=1, confs=[template]):
+        return None
+    with open(f'{dir_path}/{template}') as fh:
+        return fh.read()
 
 
 aws_profile = os.environ.get('AWS_PROFILE')
 
 
-def aws_deploy(template, stack_name):
+def template_store(bucket, prefix):
+    if bucket is None:
+        return None
+    from deploy import TemplateStore, STORE_INDEX
+    return TemplateStore(bucket, prefix, os.path.join(dir_path, STORE_INDEX))
+
+
+def aws_deploy(template, stack_name, store=None):
+    import boto3
+    from deploy import template_args
     try:
         gen_output = gen_template(template)
         client = boto3.client('cloudformation')
         response_deploy = client.create_stack(
             StackName=stack_name,
-            TemplateBody=gen_output)
+            **template_args(gen_output, store))
+        if store is not None:
+            store.save_index()
         logging.info(response_deploy)
         logging.info("Deployment in progress")
         return response_deploy
@@ -62,7 +68,26 @@ def aws_deploy(template, stack_name):
         logging.info(err)
 
 
+def fleet_deploy(confs, max_workers, poll_interval, store=None):
+    from deploy import FleetDeployer, load_stacks
+    if confs == ['all']:
+        confs = find_confs(dir_path)
+    try:
+        stacks = load_stacks(dir_path, confs)
+        results = FleetDeployer(stacks, max_workers=max_workers,
+                                poll_interval=poll_interval,
+                                template_store=store).deploy()
+    except Exception as err:
+        logging.info("Can't deploy the fleet to AWS")
+        logging.info(err)
+        return None
+    for stack_name, status in sorted(results.items()):
+        print(f"{stack_name:40} {status}")
+    return results
+
+
 def delete_stack(stack_name):
+    import boto3
     try:
         client = boto3.client('cloudformation')
         response_delete = client.delete_stack(
@@ -75,41 +100,83 @@ def delete_stack(stack_name):
         logging.info(err)
 
 
-parser = argparse.ArgumentParser(description='Generate or deploy AWS Stack')
-parser.add_argument("--gen-template", help="Generate pipeline",
-                    type=gen_template,
-                    action="store")
-parser.add_argument("--save-template", help="Generate pipeline",
-                    type=save_template,
-                    action="store")
-
-parser.add_argument("--aws-deploy", help="Deploy Stack to AWS",
-                    type=str,
-                    action="store")
-parser.add_argument('--stack-name', help="Stack Name",
-                    type=str
-                    )
-
-parser.add_argument("--delete-stack", help="Delete Stack to AWS",
-                    type=str,
-                    action="store")
-
-args = parser.parse_args()
-
-# logging.info(args)
-
-if args.gen_template:
-    print(args.gen_template)
-elif args.aws_deploy:
-    template = args.aws_deploy
-    stack_name = args.stack_name
-    if stack_name is None:
-        logging.info("Pleas specify stack name using '--stack-name' option ")
+def main():
+    parser = argparse.ArgumentParser(description='Generate or deploy AWS Stack')
+    parser.add_argument("--gen-template", help="Generate pipeline",
+                        type=str,
+                        action="store")
+    parser.add_argument("--save-template", help="Generate pipeline",
+                        type=str,
+                        action="store")
+    parser.add_argument("--incremental", help="Skip the outputs whose conf and templates did not change",
+                        action="store_true")
+
+    parser.add_argument("--render-all", help="Render every conf file of the conf directory",
+                        action="store_true")
+    parser.add_argument("--output-dir", help="Directory of the rendered files (default: current directory)",
+                        type=str)
+    parser.add_argument("--workers", help="Number of render processes (default: CPU count)",
+                        type=int)
+    parser.add_argument("--watch", help="Keep running and re-render the outputs affected by conf or template changes",
+                        action="store_true")
+    parser.add_argument("--watch-interval", help="Seconds between two checks for changes in watch mode",
+                        type=float,
+                        default=0.05)
+
+    parser.add_argument("--aws-deploy", help="Deploy Stack to AWS",
+                        type=str,
+                        action="store")
+    parser.add_argument('--stack-name', help="Stack Name",
+                        type=str
+                        )
+
+    parser.add_argument("--fleet-deploy", help="Deploy the stacks of many conf files with change sets ('all' for the conf tree)",
+                        nargs="+",
+                        type=str)
+    parser.add_argument("--max-workers", help="Number of change sets prepared concurrently",
+                        type=int,
+                        default=8)
+    parser.add_argument("--poll-interval", help="Seconds between stack status polls",
+                        type=float,
+                        default=10)
+
+    parser.add_argument("--template-bucket", help="Deploy through S3, templates are stored under their content hash",
+                        type=str)
+    parser.add_argument("--template-prefix", help="Key prefix of the templates in the template bucket",
+                        type=str,
+                        default="templates")
+
+    parser.add_argument("--delete-stack", help="Delete Stack to AWS",
+                        type=str,
+                        action="store")
+
+    args = parser.parse_args()
+
+    # logging.info(args)
+
+    if args.gen_template:
+        print(gen_template(args.gen_template))
+    elif args.aws_deploy:
+        template = args.aws_deploy
+        stack_name = args.stack_name
+        if stack_name is None:
+            logging.info("Pleas specify stack name using '--stack-name' option ")
+        else:
+            aws_deploy(template, stack_name, template_store(args.template_bucket, args.template_prefix))
+    elif args.save_template:
+        print(save_template(args.save_template, args.incremental))
+    elif args.watch:
+        watch(dir_path, args.output_dir, args.watch_interval)
+    elif args.render_all:
+        render_all(dir_path, args.output_dir, args.workers, args.incremental)
+    elif args.fleet_deploy:
+        fleet_deploy(args.fleet_deploy, args.max_workers, args.poll_interval,
+                     template_store(args.template_bucket, args.template_prefix))
+    elif args.delete_stack:
+        delete_stack(args.delete_stack)
     else:
-        aws_deploy(template, stack_name)
-elif args.save_template:
-    print(args.save_template)
-elif args.delete_stack:
-    delete_stack(args.delete_stack)
-else:
-    logging.info("Choose an options")
\ No newline at end of file
+        logging.info("Choose an options")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+import yaml
+from render import create_environment, find_confs, render
+
+logging.basicConfig(level=logging.INFO)
+
+dir_path = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ('template-generator.py', 'aws-template-generator.py')
+
+# Offline stand-ins for the AWS and git libraries. Importing one of them writes a
+# marker file, so the benchmark also tells whether a command loaded them at all.
+STUB_MODULE = '''import os
+_marker = os.environ.get('BENCHMARK_IMPORT_MARKER')
+if _marker:
+    with open(_marker, 'a') as fh:
+        fh.write(__name__.split('.')[0] + '\\n')
+
+
+def _offline(*args, **kwargs):
+    raise RuntimeError('AWS calls are disabled in the benchmark')
+
+
+client = resource = Session = Repo = _offline
+'''
+STUB_EXCEPTIONS = '''class BotoCoreError(Exception):
+    pass
+
+
+class ClientError(Exception):
+    pass
+
+
+class WaiterError(Exception):
+    pass
+'''
+
+
+def write_stubs(stub_dir):
+    for package in ('boto3', 'botocore', 'git'):
+        os.makedirs(os.path.join(stub_dir, package), exist_ok=True)
+        with open(os.path.join(stub_dir, package, '__init__.py'), 'w') as fh:
+            fh.write(STUB_MODULE)
+    with open(os.path.join(stub_dir, 'botocore', 'exceptions.py'), 'w') as fh:
+        fh.write(STUB_EXCEPTIONS)
+
+
+def generate_tree(root, confs, resources, depth):
+    """
+    Generates a conf tree of confs files spread over 10 stack directories, and a
+    template rendering resources resources that includes a chain of depth templates.
+    """
+    templates = os.path.join(root, 'templates')
+    os.makedirs(templates, exist_ok=True)
+    for level in range(depth):
+        with open(os.path.join(templates, f'level{level}.j2'), 'w') as fh:
+            if level + 1 < depth:
+                fh.write(f'{{% include "level{level + 1}.j2" %}}\n')
+            fh.write(f'# level {level} of {{{{ user_data.name }}}}\n')
+    with open(os.path.join(templates, 'stack.yaml'), 'w') as fh:
+        fh.write("AWSTemplateFormatVersion: '2010-09-09'\n"
+                 "Description: '{{ user_data.name }}'\n")
+        if depth:
+            fh.write('{% include "level0.j2" %}\n')
+        fh.write('Resources:\n'
+                 '{%- for resource in user_data.resources %}\n'
+                 '  {{ resource.name }}:\n'
+                 '    Type: AWS::SNS::Topic\n'
+                 '    Properties:\n'
+                 '      TopicName: {{ user_data.name }}-{{ resource.name }}\n'
+                 '      Tags:\n'
+                 '      {%- for key, value in resource.tags.items() %}\n'
+                 '        - Key: {{ key }}\n'
+                 '          Value: {{ value }}\n'
+                 '      {%- endfor %}\n'
+                 '{%- endfor %}\n')
+
+    for i in range(confs):
+        conf_dir = os.path.join(root, 'conf', f'stackdir{i % 10:02d}')
+        os.makedirs(conf_dir, exist_ok=True)
+        conf_var = {
+            'template_path': 'stack.yaml',
+            'user_data': {
+                'name': f'stack{i}',
+                'resources': [{'name': f'Topic{r}', 'tags': {'Stack': f'stack{i}', 'Index': str(r)}}
+                              for r in range(resources)],
+            },
+        }
+        with open(os.path.join(conf_dir, f'stack{i}.yaml'), 'w') as fh:
+            yaml.safe_dump(conf_var, fh)
+
+
+def run_command(command, cwd, env):
+    """
+    Runs a command and returns its wall time in seconds and the peak RSS in MiB
+    of its main process (render pool workers are not included).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return elapsed, usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'median': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min': timings[0],
+    }
+
+
+def bench_startup(script, tree, env, marker, repeat):
+    """
+    Cold start of a single --gen-template, including the interpreter start.
+    """
+    fileconf = find_confs(tree)[0]
+    timings, peak = [], 0.0
+    for _ in range(repeat):
+        elapsed, rss = run_command([sys.executable, os.path.join(dir_path, script),
+                                    '--gen-template', fileconf], tree, env)
+        timings.append(elapsed)
+        peak = max(peak, rss)
+    return dict(summarize(timings), peak_rss_mib=peak, loaded=read_marker(marker))
+
+
+def bench_batch(script, tree, env, marker, workers, extra_args=()):
+    """
+    Throughput of --render-all over the whole conf tree.
+    """
+    output_dir = tempfile.mkdtemp(prefix='render-', dir=tree)
+    command = [sys.executable, os.path.join(dir_path, script), '--render-all',
+               '--output-dir', output_dir, *extra_args]
+    if workers:
+        command += ['--workers', str(workers)]
+    shutil.rmtree(os.path.join(tree, '.jinja-cache'), ignore_errors=True)
+    cold, cold_rss = run_command(command, tree, env)
+    warm, warm_rss = run_command(command, tree, env)
+    confs = len(find_confs(tree))
+    return {
+        'seconds_cold': cold,
+        'seconds_warm': warm,
+        'renders_per_second': confs / cold,
+        'peak_rss_mib': max(cold_rss, warm_rss),
+        'loaded': read_marker(marker),
+    }
+
+
+def bench_render(tree, repeat):
+    """
+    In-process latency of one render with a warm environment, shared by both scripts.
+    """
+    env = create_environment(tree)
+    confs = find_confs(tree)[:repeat]
+    render(env, tree, confs[0])
+    timings = []
+    for fileconf in confs:
+        start = time.perf_counter()
+        render(env, tree, fileconf)
+        timings.append(time.perf_counter() - start)
+    return {key: value * 1000 for key, value in summarize(timings).items()}
+
+
+def read_marker(marker):
+    try:
+        with open(marker) as fh:
+            loaded = sorted(set(fh.read().split()))
+        os.remove(marker)
+        return loaded
+    except OSError:
+        return []
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=dir_path, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='template-benchmark-')
+    stub_dir = os.path.join(work_dir, 'stubs')
+    marker = os.path.join(work_dir, 'imports.txt')
+    write_stubs(stub_dir)
+    env = dict(os.environ, PYTHONPATH=stub_dir, BENCHMARK_IMPORT_MARKER=marker,
+               AWS_EC2_METADATA_DISABLED='true')
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scenarios': [],
+    }
+    try:
+        for resources in args.resources:
+            for depth in args.depths:
+                tree = os.path.join(work_dir, f'tree-r{resources}-d{depth}')
+                generate_tree(tree, args.confs, resources, depth)
+                scenario = {'confs': args.confs, 'resources': resources, 'depth': depth,
+                            'render_ms': bench_render(tree, args.repeat), 'scripts': {}}
+                for script in SCRIPTS:
+                    scenario['scripts'][script] = {
+                        'startup_s': bench_startup(script, tree, env, marker, args.repeat),
+                        'batch': bench_batch(script, tree, env, marker, args.workers),
+                    }
+                scenario['scripts']['aws-template-generator.py']['batch_incremental'] = bench_batch(
+                    'aws-template-generator.py', tree, env, marker, args.workers, ['--incremental'])
+                results['scenarios'].append(scenario)
+                logging.info(f"Finished resources={resources} depth={depth}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def flatten(prefix, value, metrics):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(f'{prefix}.{key}' if prefix else key, item, metrics)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix] = value
+    return metrics
+
+
+def scenario_metrics(results):
+    metrics = {}
+    for scenario in results['scenarios']:
+        name = f"r{scenario['resources']}-d{scenario['depth']}"
+        flatten(name, {'render_ms': scenario['render_ms'], **scenario['scripts']}, metrics)
+    return metrics
+
+
+def print_results(results, baseline=None):
+    current = scenario_metrics(results)
+    previous = scenario_metrics(baseline) if baseline else {}
+    print(f"{'Metric':75} {'Value':>12} {'Baseline':>12} {'Ratio':>7}")
+    print("-" * 109)
+    for name, value in current.items():
+        if name in previous and previous[name]:
+            print(f"{name:75} {value:12.4f} {previous[name]:12.4f} {value / previous[name]:7.2f}")
+        else:
+            print(f"{name:75} {value:12.4f}")
+    for scenario in results['scenarios']:
+        for script, result in scenario['scripts'].items():
+            loaded = result['startup_s']['loaded']
+            if loaded:
+                print(f"r{scenario['resources']}-d{scenario['depth']} {script} --gen-template loaded: "
+                      f"{', '.join(loaded)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark startup and rendering of the template generators')
+    parser.add_argument("--confs", help="Number of conf files of each synthetic tree",
+                        type=int, default=200)
+    parser.add_argument("--resources", help="Resources rendered per template (template sizes)",
+                        type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--depths", help="Include depths of the templates",
+                        type=int, nargs="+", default=[0, 4])
+    parser.add_argument("--repeat", help="Runs of the startup and render measurements",
+                        type=int, default=5)
+    parser.add_argument("--workers", help="Render processes for --render-all",
+                        type=int)
+    parser.add_argument("--output", help="JSON file of the results (default: benchmark-results/<timestamp>.json)",
+                        type=str)
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with",
+                        type=str)
+    args = parser.parse_args()
+
+    results = run(args)
+    output = args.output or os.path.join(
+        'benchmark-results', datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as fh:
+        json.dump(results, fh, indent=1)
+    logging.info(f"Results written to {output}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_results(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from render import create_environment, load_conf, render, digest, write_atomic
+
+SUCCESS_STATUSES = {'CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE'}
+FAILURE_STATUSES = {'CREATE_FAILED', 'ROLLBACK_COMPLETE', 'ROLLBACK_FAILED',
+                    'UPDATE_ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_FAILED',
+                    'UPDATE_FAILED', 'DELETE_COMPLETE', 'DELETE_FAILED',
+                    'IMPORT_ROLLBACK_COMPLETE', 'IMPORT_ROLLBACK_FAILED'}
+# Reasons CloudFormation gives for a change set without any change
+NO_CHANGES_REASONS = ("didn't contain changes", "No updates are to be performed")
+# Largest TemplateBody CloudFormation accepts, bigger templates must be sent with TemplateURL
+MAX_TEMPLATE_BODY = 51200
+# Stack names CloudFormation accepts
+STACK_NAME_PATTERN = re.compile(r'[A-Za-z][-A-Za-z0-9]{0,127}')
+# Keys of the templates already uploaded per bucket, kept in the working directory
+STORE_INDEX = '.template-store-index.json'
+
+
+class TemplateStore:
+    """
+    TemplateStore keeps the rendered templates in S3 under the hash of their
+    content, so a template shared by many stacks is uploaded once and templates
+    over the TemplateBody size limit can be deployed with TemplateURL.
+    The object keys already uploaded are recorded in a local index to avoid a
+    HEAD request per deploy.
+
+    Parameters:
+        - bucket (str): The S3 bucket of the templates.
+        - prefix (str): The key prefix of the templates in the bucket.
+        - index_path (str): Path of the local index of uploaded keys.
+        - client: Optional S3 client.
+    """
+
+    def __init__(self, bucket, prefix='templates', index_path=STORE_INDEX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.index_path = index_path
+        self.client = client or boto3.client('s3')
+        self.lock = threading.Lock()
+        self.region = None
+        try:
+            with open(index_path) as fh:
+                self.index = set(json.load(fh).get(bucket, []))
+        except (OSError, ValueError):
+            self.index = set()
+
+    def key_for(self, template_digest):
+        return f'{self.prefix}/{template_digest}.template' if self.prefix else f'{template_digest}.template'
+
+    def url(self, template_digest):
+        with self.lock:
+            if self.region is None:
+                location = self.client.get_bucket_location(Bucket=self.bucket)['LocationConstraint']
+                self.region = location or 'us-east-1'
+        return f'https://{self.bucket}.s3.{self.region}.amazonaws.com/{self.key_for(template_digest)}'
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, template):
+        """
+        Uploads the template unless its key is already in the index or in the
+        bucket, and returns its TemplateURL.
+        """
+        template_digest = digest(template)
+        key = self.key_for(template_digest)
+        with self.lock:
+            known = key in self.index
+        if not known:
+            if not self.exists(key):
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=template.encode(),
+                                       ContentType='text/yaml')
+                logging.info(f"Uploaded template s3://{self.bucket}/{key}")
+            with self.lock:
+                self.index.add(key)
+        return self.url(template_digest)
+
+    def save_index(self):
+        with self.lock:
+            try:
+                with open(self.index_path) as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError):
+                data = {}
+            data[self.bucket] = sorted(set(data.get(self.bucket, [])) | self.index)
+            write_atomic(self.index_path, json.dumps(data, indent=1))
+
+
+def template_args(template, template_store=None):
+    """
+    The template argument of create_stack/create_change_set: TemplateURL when a
+    template store is used, TemplateBody otherwise.
+    """
+    if template_store is not None:
+        return {'TemplateURL': template_store.put(template)}
+    if len(template.encode()) > MAX_TEMPLATE_BODY:
+        logging.info(f"Template is over the {MAX_TEMPLATE_BODY} bytes TemplateBody limit, "
+                     "use a template bucket")
+    return {'TemplateBody': template}
+
+
+def stack_name_for(fileconf, conf_var):
+    """
+    The stack name is the conf 'stack_name', or the conf path without the
+    extension (stackdir01/vpc.yaml -> stackdir01-vpc).
+    Raises ValueError when it is not a valid CloudFormation stack name.
+    """
+    if conf_var.get('stack_name'):
+        name = str(conf_var['stack_name'])
+    else:
+        name = os.path.splitext(fileconf)[0].replace(os.sep, '-').replace('_', '-')
+    if not STACK_NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"{fileconf}: invalid stack name '{name}', stack names must match "
+                         f"{STACK_NAME_PATTERN.pattern}")
+    return name
+
+
+def load_stacks(dir_path, confs):
+    """
+    Renders the template of every conf file with a single Jinja environment.
+    Dependencies are declared in the conf with 'depends_on', a list of stack names.
+    Returns a dict of stack name -> {'conf', 'template', 'depends_on'}.
+    Raises ValueError listing every conf with an invalid or duplicate stack
+    name, before anything is deployed.
+    """
+    env = create_environment(dir_path)
+    stacks = {}
+    errors = []
+    for fileconf in confs:
+        conf_var = load_conf(dir_path, fileconf)
+        try:
+            name = stack_name_for(fileconf, conf_var)
+        except ValueError as err:
+            errors.append(str(err))
+            continue
+        if name in stacks:
+            errors.append(f"{fileconf}: stack name '{name}' is already used by {stacks[name]['conf']}")
+            continue
+        stacks[name] = {
+            'conf': fileconf,
+            'template': render(env, dir_path, fileconf),
+            'depends_on': list(conf_var.get('depends_on') or []),
+        }
+    if errors:
+        raise ValueError("Invalid stack names:\n" + "\n".join(errors))
+    return stacks
+
+
+class FleetDeployer:
+    """
+    FleetDeployer deploys many stacks with change sets. Change sets are created
+    concurrently, a stack is only started once the stacks it depends on are
+    deployed, change sets without changes are skipped. On every poll the change
+    sets being created are checked concurrently and the progress of every
+    running stack is followed with a single paginated describe_stacks call.
+
+    Parameters:
+        - stacks (dict): stack name -> {'template', 'depends_on'}, see load_stacks.
+        - client: Optional CloudFormation client, e.g. one created under moto.
+        - max_workers (int): Number of concurrent create_change_set and
+          describe_change_set calls.
+        - poll_interval (float): Seconds between two polls.
+        - template_store (TemplateStore): Optional S3 store, templates are then
+          deployed with TemplateURL.
+    """
+
+    def __init__(self, stacks, client=None, max_workers=8, poll_interval=10,
+                 template_store=None):
+        self.stacks = stacks
+        self.client = client or boto3.client('cloudformation')
+        self.template_store = template_store
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.results = {}
+        # One change set name per stack, change set names must be unique per stack
+        # and some CloudFormation stand-ins look them up by name only
+        timestamp = int(time.time())
+        self.change_set_names = {name: f'fleet-deploy-{timestamp}-{index}'
+                                 for index, name in enumerate(stacks)}
+
+    def check_dependencies(self):
+        """
+        Ignores dependencies outside the fleet (they are expected to be deployed
+        already) and raises ValueError on a dependency cycle.
+        """
+        for name, stack in self.stacks.items():
+            external = [dep for dep in stack['depends_on'] if dep not in self.stacks]
+            if external:
+                logging.info(f"{name}: dependencies outside the fleet are not waited for: {external}")
+            stack['depends_on'] = [dep for dep in stack['depends_on'] if dep in self.stacks]
+
+        visiting, done = set(), set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError("Dependency cycle: " + " -> ".join(path + [name]))
+            visiting.add(name)
+            for dep in self.stacks[name]['depends_on']:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stacks:
+            visit(name, [])
+
+    def describe_stacks(self):
+        """
+        Returns the status of every stack of the account and region, from a
+        single paginated describe_stacks call.
+        """
+        statuses = {}
+        for page in self.client.get_paginator('describe_stacks').paginate():
+            for stack in page['Stacks']:
+                statuses[stack['StackName']] = stack['StackStatus']
+        return statuses
+
+    def prepare(self, name, existing_status):
+        """
+        Creates the change set of a stack. Its creation is followed by
+        check_change_sets instead of waiting for it here.
+        """
+        change_set_type = 'UPDATE'
+        if existing_status is None or existing_status == 'REVIEW_IN_PROGRESS':
+            change_set_type = 'CREATE'
+        self.client.create_change_set(
+            StackName=name,
+            ChangeSetName=self.change_set_names[name],
+            ChangeSetType=change_set_type,
+            **self.stacks[name]['template_args'])
+
+    def change_set_status(self, name):
+        try:
+            change_set = self.client.describe_change_set(
+                StackName=name, ChangeSetName=self.change_set_names[name])
+            return change_set['Status'], change_set.get('StatusReason', '')
+        except (BotoCoreError, ClientError) as err:
+            return 'FAILED', str(err)
+
+    def check_change_sets(self, executor, change_sets, running):
+        """
+        Checks every change set being created, concurrently. A created change set
+        is executed and its stack moves to running, a change set without changes
+        is deleted and its stack is UNCHANGED.
+        """
+        names = sorted(change_sets)
+        for name, (status, reason) in zip(names, executor.map(self.change_set_status, names)):
+            if status in ('CREATE_PENDING', 'CREATE_IN_PROGRESS'):
+                continue
+            change_sets.discard(name)
+            try:
+                if status == 'CREATE_COMPLETE':
+                    self.client.execute_change_set(StackName=name, ChangeSetName=self.change_set_names[name])
+                    running.add(name)
+                elif any(no_change in reason for no_change in NO_CHANGES_REASONS):
+                    self.client.delete_change_set(StackName=name, ChangeSetName=self.change_set_names[name])
+                    self.finish(name, 'UNCHANGED')
+                else:
+                    self.finish(name, f"FAILED: Change set failed: {reason}")
+            except (BotoCoreError, ClientError) as err:
+                self.finish(name, f"FAILED: {err}")
+
+    def finish(self, name, result):
+        self.results[name] = result
+        logging.info(f"{name}: {result}")
+
+    def deploy(self):
+        """
+        Deploys the fleet and returns a dict of stack name -> final status
+        (a CloudFormation status, UNCHANGED, SKIPPED or an error message).
+        The change sets being created and the stacks being deployed are all
+        followed from this thread, every poll_interval, so no worker waits on
+        a single stack.
+        """
+        self.check_dependencies()
+        existing = self.describe_stacks()
+        pending = set(self.stacks)
+        creating = {}
+        change_sets = set()
+        running = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Upload every distinct template once before creating the change sets
+            templates = {stack['template'] for stack in self.stacks.values()}
+            args = dict(zip(templates, executor.map(
+                lambda template: template_args(template, self.template_store), templates)))
+            for stack in self.stacks.values():
+                stack['template_args'] = args[stack['template']]
+            if self.template_store is not None:
+                self.template_store.save_index()
+
+            while pending or creating or change_sets or running:
+                for name in sorted(pending):
+                    deps = self.stacks[name]['depends_on']
+                    if any(dep in self.results and self.results[dep] not in SUCCESS_STATUSES | {'UNCHANGED'}
+                           for dep in deps):
+                        pending.discard(name)
+                        self.finish(name, 'SKIPPED')
+                    elif all(dep in self.results for dep in deps):
+                        pending.discard(name)
+                        creating[executor.submit(self.prepare, name, existing.get(name))] = name
+
+                if creating:
+                    done, _ = wait(creating, timeout=0 if change_sets or running else self.poll_interval,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = creating.pop(future)
+                        try:
+                            future.result()
+                            change_sets.add(name)
+                        except (BotoCoreError, ClientError) as err:
+                            self.finish(name, f"FAILED: {err}")
+                    if not change_sets and not running:
+                        continue
+
+                time.sleep(self.poll_interval)
+                if change_sets:
+                    self.check_change_sets(executor, change_sets, running)
+                if running:
+                    statuses = self.describe_stacks()
+                    for name in list(running):
+                        status = statuses.get(name)
+                        if status in SUCCESS_STATUSES or status in FAILURE_STATUSES or status is None:
+                            running.discard(name)
+                            self.finish(name, status or 'DELETE_COMPLETE')
+        return self.results
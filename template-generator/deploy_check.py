@@ -0,0 +1,129 @@
+import os
+import shutil
+import logging
+import argparse
+import tempfile
+
+import boto3
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_aws
+
+from deploy import FleetDeployer, TemplateStore, load_stacks
+from render import find_confs
+
+logging.basicConfig(level=logging.INFO)
+
+TEMPLATE = ("AWSTemplateFormatVersion: '2010-09-09'\n"
+            "Description: '{{ user_data.description }}'\n"
+            "Resources:\n"
+            "  Topic:\n"
+            "    Type: AWS::SNS::Topic\n"
+            "    Properties:\n"
+            "      TopicName: {{ user_data.topic }}\n")
+
+
+def write_conf(root, fileconf, content):
+    path = os.path.join(root, 'conf', fileconf)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fh:
+        fh.write(content)
+
+
+def generate_tree(root):
+    """
+    A network stack, an app stack depending on it and an independent db stack.
+    """
+    os.makedirs(os.path.join(root, 'templates'), exist_ok=True)
+    with open(os.path.join(root, 'templates', 'topic.yaml'), 'w') as fh:
+        fh.write(TEMPLATE)
+    write_conf(root, 'stackdir01/network.yaml',
+               'template_path: topic.yaml\nuser_data: {description: network, topic: network}\n')
+    write_conf(root, 'stackdir01/app.yaml',
+               'template_path: topic.yaml\nstack_name: app\ndepends_on: [stackdir01-network]\n'
+               'user_data: {description: app, topic: app}\n')
+    write_conf(root, 'stackdir02/db.yaml',
+               'template_path: topic.yaml\nuser_data: {description: db, topic: db}\n')
+
+
+def deploy(root, client, poll_interval, template_store=None):
+    stacks = load_stacks(root, find_confs(root))
+    return FleetDeployer(stacks, client=client, poll_interval=poll_interval,
+                         template_store=template_store).deploy()
+
+
+def check(root, poll_interval):
+    cloudformation = boto3.client('cloudformation', region_name='us-east-1')
+    s3 = boto3.client('s3', region_name='us-east-1')
+    generate_tree(root)
+
+    results = deploy(root, cloudformation, poll_interval)
+    assert results == {'app': 'CREATE_COMPLETE', 'stackdir01-network': 'CREATE_COMPLETE',
+                       'stackdir02-db': 'CREATE_COMPLETE'}, results
+
+    results = deploy(root, cloudformation, poll_interval)
+    assert set(results.values()) == {'UNCHANGED'}, results
+
+    write_conf(root, 'stackdir02/db.yaml',
+               'template_path: topic.yaml\nuser_data: {description: db v2, topic: db}\n')
+    results = deploy(root, cloudformation, poll_interval)
+    assert results == {'app': 'UNCHANGED', 'stackdir01-network': 'UNCHANGED',
+                       'stackdir02-db': 'UPDATE_COMPLETE'}, results
+
+    # A connection error on the network stack fails it and skips the app depending on it
+    def unreachable(params, **kwargs):
+        if params['StackName'] == 'stackdir01-network':
+            raise EndpointConnectionError(endpoint_url='https://cloudformation.us-east-1.amazonaws.com')
+    cloudformation.meta.events.register('before-parameter-build.cloudformation.CreateChangeSet', unreachable)
+    write_conf(root, 'stackdir01/network.yaml',
+               'template_path: topic.yaml\nuser_data: {description: network v2, topic: network}\n')
+    results = deploy(root, cloudformation, poll_interval)
+    assert results['stackdir01-network'].startswith('FAILED'), results
+    assert results['app'] == 'SKIPPED', results
+    cloudformation.meta.events.unregister('before-parameter-build.cloudformation.CreateChangeSet', unreachable)
+
+    # Templates are uploaded once per prefix
+    s3.create_bucket(Bucket='fleet-templates')
+    index_path = os.path.join(root, 'index.json')
+    for prefix in ('a', 'b'):
+        deploy(root, cloudformation, poll_interval, TemplateStore('fleet-templates', prefix, index_path, s3))
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket='fleet-templates')['Contents']]
+    assert len(keys) == 6 and {key.split('/')[0] for key in keys} == {'a', 'b'}, keys
+
+    write_conf(root, 'stackdir03/bad.yaml', 'template_path: topic.yaml\nstack_name: Bad Name\n'
+               'user_data: {description: bad, topic: bad}\n')
+    try:
+        load_stacks(root, find_confs(root))
+        raise AssertionError('invalid stack name accepted')
+    except ValueError as err:
+        assert 'stackdir03/bad.yaml' in str(err), err
+    os.remove(os.path.join(root, 'conf', 'stackdir03', 'bad.yaml'))
+
+    stacks = load_stacks(root, find_confs(root))
+    stacks['stackdir01-network']['depends_on'] = ['app']
+    try:
+        FleetDeployer(stacks, client=cloudformation).check_dependencies()
+        raise AssertionError('dependency cycle accepted')
+    except ValueError as err:
+        assert 'cycle' in str(err), err
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the fleet deployer and the template store against moto')
+    parser.add_argument("--poll-interval", help="Seconds between stack status polls",
+                        type=float,
+                        default=0.1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    root = tempfile.mkdtemp(prefix='fleet-check-')
+    try:
+        with mock_aws():
+            check(root, args.poll_interval)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print("Fleet deploy checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import yaml
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateNotFound, meta
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from functools import partial
+
+# Compiled templates are kept here between renders and between runs
+CACHE_DIR = '.jinja-cache'
+CONF_EXTENSIONS = ('.yaml', '.yml')
+# Input and output hashes of the rendered files, kept in the output directory
+MANIFEST = '.render-manifest.json'
+# The umask can only be read by setting it, read once so no thread sees it changed
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def create_environment(dir_path):
+    """
+    Creates the Jinja environment for the templates directory, with a
+    persistent bytecode cache so templates are only compiled once.
+    """
+    cache_dir = os.path.join(dir_path, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    file_loader = FileSystemLoader([os.path.join(dir_path, 'templates')])
+    return Environment(loader=file_loader,
+                       bytecode_cache=FileSystemBytecodeCache(cache_dir))
+
+
+def load_conf(dir_path, fileconf):
+    with open(os.path.join(dir_path, 'conf', fileconf)) as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def render(env, dir_path, fileconf):
+    conf_var = load_conf(dir_path, fileconf)
+    jinja_template = env.get_template(conf_var['template_path'])
+    return jinja_template.render(conf_var)
+
+
+def digest(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_atomic(path, content):
+    """
+    Writes the file through a temporary file in the same directory and renames
+    it, so readers never see a partially written output. The file gets the mode
+    of a file created with open(), mkstemp creates it readable by its owner only.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(content)
+        os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_if_changed(path, content):
+    """
+    Writes the file only when its content changes, so the mtime of an
+    unchanged output is preserved. Returns True when the file was written.
+    """
+    try:
+        with open(path) as fh:
+            if fh.read() == content:
+                return False
+    except OSError:
+        pass
+    write_atomic(path, content)
+    return True
+
+
+def file_digest(path):
+    try:
+        with open(path, 'rb') as fh:
+            return digest(fh.read())
+    except OSError:
+        return None
+
+
+class DependencyGraph:
+    """
+    Resolves the templates a template depends on through include, extends
+    and import, and hashes the sources of the whole dependency graph.
+    A dynamic include (a name computed at render time) makes the template
+    depend on every template.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.templates = {}
+
+    def _load(self, name):
+        if name not in self.templates:
+            source, _, _ = self.env.loader.get_source(self.env, name)
+            references = set(meta.find_referenced_templates(self.env.parse(source)))
+            self.templates[name] = (digest(source), references)
+        return self.templates[name]
+
+    def closure(self, name):
+        seen = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            try:
+                references = self._load(current)[1]
+            except TemplateNotFound:
+                # Still a dependency, the conf is affected when the template is created
+                continue
+            if None in references:
+                pending.extend(self.env.list_templates())
+            pending.extend(reference for reference in references if reference is not None)
+        return seen
+
+    def digest(self, name):
+        return digest(''.join(f'{dependency}:{self._load(dependency)[0]}\n'
+                              for dependency in sorted(self.closure(name))))
+
+
+def input_digest(graph, dir_path, fileconf, entry):
+    """
+    Hash of everything a rendered file depends on: the conf file and the
+    dependency graph of its template. The template of an unchanged conf file
+    is taken from its manifest entry instead of parsing the conf again.
+    Returns the input hash, the conf hash and the template path.
+    """
+    with open(os.path.join(dir_path, 'conf', fileconf), 'rb') as file:
+        conf_bytes = file.read()
+    conf_digest = digest(conf_bytes)
+    template_path = entry.get('template')
+    if template_path is None or entry.get('conf') != conf_digest:
+        template_path = yaml.load(conf_bytes, Loader=yaml.FullLoader)['template_path']
+    return digest(conf_bytes + graph.digest(template_path).encode()), conf_digest, template_path
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def find_confs(dir_path):
+    """
+    Returns the path, relative to conf/, of every conf file in the conf tree.
+    """
+    conf_dir = os.path.join(dir_path, 'conf')
+    confs = []
+    for root, _, files in os.walk(conf_dir):
+        for name in files:
+            if name.endswith(CONF_EXTENSIONS):
+                confs.append(os.path.relpath(os.path.join(root, name), conf_dir))
+    return sorted(confs)
+
+
+_worker_env = None
+
+
+def _init_worker(dir_path):
+    # Every worker process builds its environment once and reuses it
+    global _worker_env
+    _worker_env = create_environment(dir_path)
+
+
+def _render_to_file(dir_path, output_dir, fileconf):
+    try:
+        output = render(_worker_env, dir_path, fileconf)
+        write_if_changed(os.path.join(output_dir, fileconf), output)
+        return fileconf, None, digest(output)
+    except Exception as err:
+        return fileconf, str(err), None
+
+
+def render_all(dir_path, output_dir=None, workers=None, incremental=False, confs=None):
+    """
+    Renders every conf file of the conf tree (or only confs) to output_dir
+    (dir_path by default), keeping the conf tree layout, with a pool of worker
+    processes. Outputs whose content does not change are not rewritten.
+
+    In incremental mode the hash of the conf file and of its template dependency
+    graph is recorded for each output in the manifest, and the files whose inputs
+    and output did not change since the last run are not rendered at all.
+    Returns the list of (conf file, error) of the failed renders.
+    """
+    output_dir = output_dir or dir_path
+    confs = find_confs(dir_path) if confs is None else confs
+    if not confs:
+        logging.info("No conf files found")
+        return []
+
+    # Compile every template once up front, the workers load them from the bytecode cache
+    env = create_environment(dir_path)
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+        except Exception as err:
+            logging.info(f"Can't compile {name}")
+            logging.info(err)
+
+    stale = confs
+    if incremental:
+        manifest = load_manifest(output_dir)
+        graph = DependencyGraph(env)
+        inputs = {}
+        stale = []
+        for fileconf in confs:
+            entry = manifest.get(fileconf, {})
+            try:
+                inputs[fileconf] = input_digest(graph, dir_path, fileconf, entry)
+            except Exception:
+                # Let the render report the error
+                inputs[fileconf] = None
+            if inputs[fileconf] is None or entry.get('input') != inputs[fileconf][0] \
+                    or file_digest(os.path.join(output_dir, fileconf)) != entry.get('output'):
+                stale.append(fileconf)
+
+    workers = min(workers or os.cpu_count() or 1, len(stale) or 1)
+    if workers == 1:
+        # Not worth starting a pool, render in this process with the same environment
+        global _worker_env
+        _worker_env = env
+        results = [_render_to_file(dir_path, output_dir, fileconf) for fileconf in stale]
+    else:
+        # Only imported here, loading multiprocessing slows down the start of single renders
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(stale) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(dir_path,)) as executor:
+            results = list(executor.map(partial(_render_to_file, dir_path, output_dir),
+                                        stale, chunksize=chunksize))
+
+    failed = [(fileconf, err) for fileconf, err, _ in results if err is not None]
+    for fileconf, err in failed:
+        logging.info(f"Can't generate {fileconf}")
+        logging.info(err)
+
+    if incremental:
+        for fileconf, err, output_digest in results:
+            if err is None and inputs[fileconf] is not None:
+                input_hash, conf_digest, template_path = inputs[fileconf]
+                manifest[fileconf] = {'input': input_hash, 'output': output_digest,
+                                      'conf': conf_digest, 'template': template_path}
+            else:
+                manifest.pop(fileconf, None)
+        write_atomic(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True))
+
+    logging.info(f"Rendered {len(stale) - len(failed)} of {len(confs)} templates, "
+                 f"{len(confs) - len(stale)} unchanged")
+    return failed
+
+
+def snapshot(dir_path):
+    """
+    Returns the mtime of every file of the conf and templates trees.
+    """
+    mtimes = {}
+    for tree in ('conf', 'templates'):
+        for root, _, files in os.walk(os.path.join(dir_path, tree)):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    pass
+    return mtimes
+
+
+def watch(dir_path, output_dir=None, interval=0.05):
+    """
+    Renders every conf file, then keeps the Jinja environment and the template
+    dependency graph in memory and, on every change in the conf or templates
+    trees, re-renders only the outputs of the changed conf files and of the conf
+    files whose template dependency graph contains a changed template.
+    Runs until interrupted.
+    """
+    output_dir = output_dir or dir_path
+    conf_dir = os.path.join(dir_path, 'conf')
+    template_dir = os.path.join(dir_path, 'templates')
+    env = create_environment(dir_path)
+    graph = DependencyGraph(env)
+    dependencies = {}
+
+    def update_dependencies(fileconf):
+        try:
+            conf_var = load_conf(dir_path, fileconf)
+            dependencies[fileconf] = graph.closure(conf_var['template_path'])
+        except Exception:
+            # Rendered again on its next change, the render reports the error
+            dependencies[fileconf] = set()
+
+    def render_confs(confs):
+        for fileconf in confs:
+            start = time.perf_counter()
+            try:
+                output = render(env, dir_path, fileconf)
+                if write_if_changed(os.path.join(output_dir, fileconf), output):
+                    logging.info(f"Rendered {fileconf} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            except Exception as err:
+                logging.info(f"Can't generate {fileconf}")
+                logging.info(err)
+
+    for fileconf in find_confs(dir_path):
+        update_dependencies(fileconf)
+    render_confs(sorted(dependencies))
+    previous = snapshot(dir_path)
+    logging.info(f"Watching {conf_dir} and {template_dir}")
+
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(dir_path)
+            changed = {path for path in current.keys() | previous.keys()
+                       if current.get(path) != previous.get(path)}
+            previous = current
+            if not changed:
+                continue
+
+            affected = set()
+            changed_templates = set()
+            for path in changed:
+                if path.startswith(conf_dir + os.sep):
+                    fileconf = os.path.relpath(path, conf_dir)
+                    if not fileconf.endswith(CONF_EXTENSIONS):
+                        continue
+                    if path in current:
+                        affected.add(fileconf)
+                    else:
+                        dependencies.pop(fileconf, None)
+                else:
+                    changed_templates.add(os.path.relpath(path, template_dir).replace(os.sep, '/'))
+
+            for name in changed_templates:
+                graph.templates.pop(name, None)
+            affected.update(fileconf for fileconf, templates in dependencies.items()
+                            if templates & changed_templates)
+            for fileconf in affected:
+                update_dependencies(fileconf)
+            render_confs(sorted(affected))
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
@@ -1,35 +1,42 @@
-import yaml
-from jinja2 import Environment, FileSystemLoader
 import os
 import logging
 import argparse
+from render import create_environment, render, render_all
 
 logging.basicConfig(level=logging.INFO)
 
 def gen_template(pipeline):
     dir_path = os.getcwd()
     try:
-        with open(f'{dir_path}/conf/{pipeline}') as file:
-            conf_var = yaml.load(file, Loader=yaml.FullLoader)
-
-        file_loader = FileSystemLoader([os.path.join(dir_path, 'templates')])
-
-        env = Environment(loader=file_loader)
-        jinja_template = env.get_template(conf_var['template_path'])
-        output = jinja_template.render(conf_var)
-        return output
+        return render(create_environment(dir_path), dir_path, pipeline)
     except Exception as err:
         logging.info("Can't generate pipeline")
         logging.info(err)
 
 
-parser = argparse.ArgumentParser(description='Generate or deploy AWS Stack')
-parser.add_argument("--gen-template", help="Generate pipeline",
-                    type=gen_template,
-                    action="store")
-args = parser.parse_args()
+def main():
+    parser = argparse.ArgumentParser(description='Generate or deploy AWS Stack')
+    parser.add_argument("--gen-template", help="Generate pipeline",
+                        type=str,
+                        action="store")
+    parser.add_argument("--render-all", help="Render every conf file of the conf directory",
+                        action="store_true")
+    parser.add_argument("--output-dir", help="Directory of the rendered files (default: current directory)",
+                        type=str)
+    parser.add_argument("--workers", help="Number of render processes (default: CPU count)",
+                        type=int)
+    parser.add_argument("--incremental", help="Skip the outputs whose conf and templates did not change",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if args.gen_template:
+        print(gen_template(args.gen_template))
+    elif args.render_all:
+        render_all(os.getcwd(), args.output_dir, args.workers, args.incremental)
+    else:
+        logging.info("Something is not right ...")
+
 
-if args.gen_template:
-    print(args.gen_template)
-else:
-    logging.info("Something is not right ...")
\ No newline at end of file
+# The render workers import this script again under the spawn start method
+if __name__ == '__main__':
+    main()